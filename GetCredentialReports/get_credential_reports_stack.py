@@ -27,6 +27,14 @@ class GetCredentialReportsStack(Stack):
         with open("lambda-handler.py", encoding="utf8") as fp:
             handler_code = fp.read()
 
+        # Credential report helpers shared by the credential report stacks, benchmarks and tests stay out of the asset
+        core_layer = lambda_.LayerVersion(
+            self, "CredentialReportCoreLayer",
+            code=lambda_.Code.from_asset("../credential_report_core", exclude=["benchmarks", "tests"]),
+            compatible_runtimes=[lambda_.Runtime.PYTHON_3_9],
+            description="Shared credential report parsing, expiry and digest helpers"
+        )
+
         lambdaFn = lambda_.Function(
             self, "GetCredentialReportLambdaFunction",
             function_name = "GetCredentialReport",
@@ -37,6 +45,7 @@ class GetCredentialReportsStack(Stack):
             environment= {
                         'sns_topic': (topic)
                         },
+            layers = [core_layer],
             role = (lambda_role)
             )
 
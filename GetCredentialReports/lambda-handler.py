@@ -1,11 +1,10 @@
 import boto3
 from botocore.exceptions import ClientError
-import os
-import csv, codecs
-from time import sleep
-import datetime
-import dateutil.parser
+import os, json
+from time import time
 import logging
+# Shared with MultiAccountDeployment through the credential_report_core layer
+from credential_report import CredentialAudit, ExpiryDigest, read_report, iter_credential_report, get_credential_report, get_max_password_age
 
 logger = logging.getLogger()
 logging.basicConfig(
@@ -13,6 +12,15 @@ logging.basicConfig(
 )
 logger.setLevel(os.getenv('log_level', logging.INFO))
 
+# seconds an existing credential report is reused for, IAM expires reports after 4 hours
+report_max_age = int(os.getenv('report_max_age', 3600))
+# expired passwords older than this many days are listed in their own section
+long_expired_days = int(os.getenv('long_expired_days', 90))
+# upper bound in characters for one notification, longer digests are split
+digest_max_size = int(os.getenv('digest_max_size', 4000))
+# JSON object overriding the audit rule thresholds, e.g. {"access_key_rotation": 180, "mfa_missing": false}
+credential_rules = json.loads(os.getenv('credential_rules') or '{}')
+
 # set local testing configuration
 LOCAL_TESTING = False
 
@@ -25,43 +33,6 @@ else:
     iam_client = boto3.client('iam')
     sns_topic = os.environ['sns_topic']
 
-def days_till_expire(last_changed, max_age):
-    if type(last_changed) is str:
-        last_changed_date=dateutil.parser.parse(last_changed).date()
-    elif type(last_changed) is datetime.datetime:
-        last_changed_date=last_changed.date()
-    else:
-        return -99999
-    expires = (last_changed_date + datetime.timedelta(max_age)) - datetime.date.today()
-    return(expires.days)
-
-def get_credential_report(iam_client):
-    resp1 = iam_client.generate_credential_report()
-    if resp1['State'] == 'COMPLETE' :
-        try: 
-            response = iam_client.get_credential_report()
-            credential_report_csv = response['Content']
-            reader = csv.DictReader(codecs.iterdecode(credential_report_csv.splitlines(), 'utf-8'))
-            credential_report = {}
-            for row in reader:
-                key = row['user']
-                credential_report[key] = row
-            return(credential_report)
-        except ClientError as e:
-            logger.exception(e)
-            print("Unknown error getting Report: " + e.message)
-    else:
-        sleep(2)
-        return get_credential_report(iam_client)
-
-def get_max_password_age(iam_client):
-    try: 
-        response = iam_client.get_account_password_policy()
-        return response['PasswordPolicy']['MaxPasswordAge']
-    except ClientError as e:
-        logger.exception(e)
-        print("Unexpected error in get_max_password_age: %s" + e.message) 
-
 if LOCAL_TESTING:
     logger.info("Local testing: {}".format(LOCAL_TESTING))
     logger.info("SNSTopic: {}".format(sns_topic))
@@ -69,19 +40,21 @@ if LOCAL_TESTING:
     def main(): 
         try:
             max_age = get_max_password_age(iam_client)
-            credential_report = get_credential_report(iam_client)
-            for user in credential_report:
-                if credential_report[user]['password_enabled'] != 'true':
+            credential_report = get_credential_report(iam_client, reuse_age = report_max_age)
+            digest = ExpiryDigest(long_expired_days, digest_max_size)
+            # The CSV is read once, expiry and the audit rules work on the same columns
+            report = read_report(credential_report)
+            for row in iter_credential_report(report, max_age):
+                user = row.user
+                if not row.password_enabled:
                     logger.info("Skipping service users: {}".format(user))
-                else:
-                    message = ""
-                    password_expires = days_till_expire(credential_report[user]['password_last_changed'], max_age)
-                    if password_expires > 0:
-                        message = "Password expires for user: {}".format(user) + " in: " + (format(abs(password_expires * -1))) + " days"
-                        logger.info(message)
-                    elif password_expires < 90 :
-                        message = "ATTENTION! Password expired for user: {}".format(user) + ": " + format(password_expires * -1) + " days ago"
-                        logger.info(message)
+                elif row.password_expires is not None:
+                    digest.add(user, row.password_expires)
+            for message in digest.messages(""):
+                logger.info(message)
+            audit = CredentialAudit(credential_rules, digest_max_size).evaluate(report)
+            for message in audit.messages("Credential audit"):
+                logger.info(message)
         except ClientError as e:
             logger.exception(e)
 
@@ -94,27 +67,31 @@ else:
     def handler(event, context): 
         try:
             max_age = get_max_password_age(iam_client)
-            credential_report = get_credential_report(iam_client)
-            for user in credential_report:
-                if credential_report[user]['password_enabled'] != 'true':
+            # Leave a few seconds of the invocation for the notifications
+            deadline = time() + context.get_remaining_time_in_millis() / 1000 - 5
+            credential_report = get_credential_report(iam_client, deadline, report_max_age)
+            digest = ExpiryDigest(long_expired_days, digest_max_size)
+            # The CSV is read once, expiry and the audit rules work on the same columns
+            report = read_report(credential_report)
+            for row in iter_credential_report(report, max_age):
+                user = row.user
+                if not row.password_enabled:
                     logger.info("Skipping service users: {}".format(user))
-                else:
-                    message = ""
-                    password_expires = days_till_expire(credential_report[user]['password_last_changed'], max_age)
-                    if password_expires > 0:
-                        message = "Password expires for user: {}".format(user) + " in: " + (format(abs(password_expires * -1))) + " days"
-                        client_sns.publish(
-                            TargetArn = sns_topic,
-                            Message = message,
-                            Subject = '--- PASSWORD EXPIRATION REPORT ---'
-                        )
-                    elif password_expires < 90 :
-                        message = "ATTENTION! Password expired for user: {}".format(user) + ": " + format(password_expires * -1) + " days ago"
-                        client_sns.publish(
-                            TargetArn = sns_topic,
-                            Message = message,
-                            Subject = '--- PASSWORD EXPIRATION REPORT ---'
-                        )
+                elif row.password_expires is not None:
+                    digest.add(user, row.password_expires)
+            for message in digest.messages(""):
+                client_sns.publish(
+                    TargetArn = sns_topic,
+                    Message = message,
+                    Subject = '--- PASSWORD EXPIRATION REPORT ---'
+                )
+            audit = CredentialAudit(credential_rules, digest_max_size).evaluate(report)
+            for message in audit.messages("Credential audit"):
+                client_sns.publish(
+                    TargetArn = sns_topic,
+                    Message = message,
+                    Subject = '--- CREDENTIAL AUDIT REPORT ---'
+                )
         except ClientError as e:
             logger.exception(e)
 
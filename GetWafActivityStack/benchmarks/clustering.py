@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Times same-CIDR detection over synthetic log records: the vectorized numpy path (ip_clustering)
+against the per-IP Counter path it replaces.
+    python benchmarks/clustering.py --records 1000000
+"""
+import argparse, os, random, socket, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda', 'code'))
+
+import ip_clustering
+from waf_wrapper import WAFWrapper
+
+def synthetic_ips(records, seed = 1):
+    # A fifth of the records come from a small pool of /24s, the rest from anywhere
+    rng = random.Random(seed)
+    hot = [rng.getrandbits(24) << 8 for _ in range(max(1, records // 2000))]
+    ips = []
+    for _ in range(records):
+        value = rng.choice(hot) | rng.getrandbits(8) if rng.random() < 0.2 else rng.getrandbits(32)
+        ips.append(socket.inet_ntoa(value.to_bytes(4, 'big')))
+    return ips
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type = int, default = 1000000)
+    args = parser.parse_args()
+
+    ips = synthetic_ips(args.records)
+    waf_wrapper = WAFWrapper(None)
+
+    packed, pack_ms = timed(ip_clustering.pack_ipv4, ips)
+    clusters, cluster_ms = timed(ip_clustering.cluster_ipv4, packed)
+    vectorized, vectorized_ms = timed(waf_wrapper.get_same_cidr_ips, ips)
+    counted, counted_ms = timed(waf_wrapper.count_same_cidr_ips, ips)
+    assert sorted(vectorized) == sorted(counted)
+
+    print(f"records:            {args.records}")
+    print(f"prefixes:           {len(clusters.prefixes)}, densest {clusters.density.max():.3f}")
+    print(f"pack_ipv4:          {pack_ms:8.1f} ms")
+    print(f"cluster_ipv4:       {cluster_ms:8.1f} ms")
+    print(f"get_same_cidr_ips:  {vectorized_ms:8.1f} ms  ({len(vectorized)} prefixes)")
+    print(f"Counter path:       {counted_ms:8.1f} ms")
+
+if __name__ == '__main__':
+    main()
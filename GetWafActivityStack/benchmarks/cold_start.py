@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Measures the cold start cost of the GetWAFActivityFunction handler module: the time to import
+index.py (which also runs create_clients_and_wrappers) in a fresh interpreter.
+
+Compare two revisions by pointing --code-dir at a checkout of each, e.g.
+    git worktree add /tmp/waf-before <commit>
+    python benchmarks/cold_start.py --code-dir /tmp/waf-before/GetWafActivityStack/lambda/code
+    python benchmarks/cold_start.py
+"""
+import argparse, json, os, statistics, subprocess, sys
+
+DEFAULT_CODE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda', 'code')
+
+# Runs in the child interpreter, only the import of the handler module is timed
+PROBE = """
+import sys, time, json
+sys.path.insert(0, sys.argv[1])
+modules = set(sys.modules)
+start = time.perf_counter()
+import index
+elapsed = time.perf_counter() - start
+print(json.dumps({'seconds': elapsed, 'modules': len(set(sys.modules) - modules)}))
+"""
+
+# Placeholder configuration, no AWS call is made while importing the module
+ENVIRONMENT = {
+    'sns_topic': 'arn:aws:sns:us-east-1:000000000000:benchmark',
+    'secretname': 'benchmark',
+    'logGroupName': 'benchmark',
+    'query': 'fields httpRequest.clientIp',
+    'ip_set_name': 'benchmark',
+    'ip_set_id': 'benchmark',
+    'AWS_ACCESS_KEY_ID': 'benchmark',
+    'AWS_SECRET_ACCESS_KEY': 'benchmark',
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'AWS_EC2_METADATA_DISABLED': 'true'
+}
+
+def run(code_dir, runs):
+    env = dict(os.environ, **ENVIRONMENT)
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', PROBE, code_dir], env = env, check = True, capture_output = True, text = True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--code-dir', default = DEFAULT_CODE_DIR, help = 'directory holding index.py')
+    parser.add_argument('--runs', type = int, default = 20)
+    args = parser.parse_args()
+
+    samples = run(os.path.abspath(args.code_dir), args.runs)
+    seconds = [sample['seconds'] * 1000 for sample in samples]
+    print(f"code dir:       {os.path.abspath(args.code_dir)}")
+    print(f"runs:           {args.runs}")
+    print(f"import + init:  median {statistics.median(seconds):.1f} ms, min {min(seconds):.1f} ms, max {max(seconds):.1f} ms")
+    print(f"modules loaded: {samples[-1]['modules']}")
+
+if __name__ == '__main__':
+    main()
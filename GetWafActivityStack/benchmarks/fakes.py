@@ -0,0 +1,139 @@
+"""
+Local stand-ins for the services used by GetWAFActivityFunction, for benchmarks and replays.
+Every client counts its calls per operation in `calls`.
+"""
+import hashlib, json, threading, time, uuid
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+class FakeClient:
+    def __init__(self):
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def _count(self, operation):
+        with self._lock:
+            self.calls[operation] += 1
+
+class FakeLogsClient(FakeClient):
+    """Serves recorded Logs Insights rows, each paired with an epoch timestamp, honouring the time window and limit."""
+    def __init__(self, timed_rows, running_polls = 1):
+        super().__init__()
+        self.timed_rows = timed_rows
+        self.running_polls = running_polls
+        self._queries = {}
+
+    def start_query(self, logGroupName, startTime, endTime, queryString, limit = 1000):
+        self._count('start_query')
+        rows = [row for timestamp, row in self.timed_rows if startTime <= timestamp <= endTime][:limit]
+        query_id = str(uuid.uuid4())
+        self._queries[query_id] = [rows, self.running_polls]
+        return {'queryId': query_id}
+
+    def get_query_results(self, queryId):
+        self._count('get_query_results')
+        query = self._queries[queryId]
+        # Report the query as running for the first polls to exercise the backoff
+        if query[1] > 0:
+            query[1] -= 1
+            return {'results': [], 'status': 'Running'}
+        return {'results': query[0], 'status': 'Complete'}
+
+    def stop_query(self, queryId):
+        self._count('stop_query')
+        return {'success': True}
+
+class WAFOptimisticLockException(Exception):
+    pass
+
+class FakeWAFClient(FakeClient):
+    class exceptions:
+        WAFOptimisticLockException = WAFOptimisticLockException
+
+    def __init__(self, addresses = (), version = 'IPV4'):
+        super().__init__()
+        self.addresses = list(addresses)
+        self.version = version
+        self.lock_token = str(uuid.uuid4())
+
+    def get_ip_set(self, Name, Scope, Id):
+        self._count('get_ip_set')
+        return {'IPSet': {'Name': Name, 'Id': Id, 'Addresses': list(self.addresses), 'IPAddressVersion': self.version}, 'LockToken': self.lock_token}
+
+    def update_ip_set(self, Name, Scope, Id, Addresses, LockToken):
+        self._count('update_ip_set')
+        if LockToken != self.lock_token:
+            raise WAFOptimisticLockException(Name)
+        self.addresses = list(Addresses)
+        self.lock_token = str(uuid.uuid4())
+        return {'NextLockToken': self.lock_token}
+
+class FakeSNSClient(FakeClient):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def publish(self, TargetArn, Message, Subject = None):
+        self._count('publish')
+        self.messages.append(Message)
+        return {'MessageId': str(uuid.uuid4())}
+
+class FakeSecretsClient(FakeClient):
+    def __init__(self, secret):
+        super().__init__()
+        self.secret = secret
+        self.version_id = str(uuid.uuid4())
+
+    def get_secret_value(self, SecretId, VersionStage = 'AWSCURRENT'):
+        self._count('get_secret_value')
+        return {'SecretString': json.dumps(self.secret), 'VersionId': self.version_id}
+
+    def describe_secret(self, SecretId):
+        self._count('describe_secret')
+        return {'VersionIdsToStages': {self.version_id: ['AWSCURRENT']}}
+
+class FakeVirusTotalHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    api_key = 'benchmark'
+    malicious_ratio = 0.05
+
+    def do_GET(self):
+        ip = self.path.rsplit('/', 1)[-1]
+        if self.headers.get('x-apikey') != self.api_key:
+            status, body = 401, {'error': {'code': 'WrongCredentialsError', 'message': 'Wrong API key'}}
+        else:
+            # Deterministic verdict per IP so replays are comparable
+            flagged = int(hashlib.md5(ip.encode()).hexdigest()[:8], 16) / 0xffffffff < self.malicious_ratio
+            stats = {'malicious': 3 if flagged else 0, 'suspicious': 0, 'harmless': 80, 'undetected': 10}
+            status, body = 200, {'data': {'id': ip, 'type': 'ip_address', 'attributes': {'last_analysis_stats': stats}}}
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+class FakeVirusTotalServer:
+    def __init__(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeVirusTotalHandler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}/api/v3"
+
+    def __enter__(self):
+        threading.Thread(target = self.server.serve_forever, daemon = True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+class FakeLambdaContext:
+    def __init__(self, timeout = 900):
+        self._deadline = time.monotonic() + timeout
+
+    def get_remaining_time_in_millis(self):
+        return int((self._deadline - time.monotonic()) * 1000)
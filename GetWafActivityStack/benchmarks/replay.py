@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Replays Logs Insights results through the GetWAFActivityFunction handler without AWS or VirusTotal.
+
+WAFv2, SNS, Secrets Manager and CloudWatch Logs are replaced by the stand-ins in fakes.py and
+VirusTotal by a local HTTP server. For each load the handler runs against fresh wrappers and the
+harness reports per-stage latency, API calls per operation and peak traced memory. Memory is traced
+in a second run because tracemalloc slows the handler down several times.
+
+    python benchmarks/replay.py --sizes 100 1000 10000 100000
+    python benchmarks/replay.py --recording results.json
+
+A recording is the JSON list of `results` rows returned by get_query_results.
+"""
+import argparse, ipaddress, json, logging, math, os, random, sys, time, tracemalloc
+from collections import defaultdict
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARK_DIR)
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, '..', 'lambda', 'code'))
+
+from fakes import (FakeLambdaContext, FakeLogsClient, FakeSecretsClient, FakeSNSClient,
+                   FakeVirusTotalHandler, FakeVirusTotalServer, FakeWAFClient)
+
+ENVIRONMENT = {
+    'sns_topic': 'arn:aws:sns:us-east-1:000000000000:replay',
+    'secretname': 'replay',
+    'logGroupName': 'replay',
+    'query': 'fields httpRequest.clientIp',
+    'ip_set_name': 'replay',
+    'ip_set_id': 'replay',
+    'query_limit': '10000',
+    'query_time_reserve': '0'
+}
+
+# Logs Insights returns at most 10000 rows per query
+QUERY_LIMIT = 10000
+
+def synthetic_rows(size, cluster_ratio = 0.2, seed = 1):
+    """Random client IPs, with cluster_ratio of them packed into /24s that trip the same-CIDR rule."""
+    rng = random.Random(seed)
+    ips = set()
+    while len(ips) < size * cluster_ratio:
+        base = rng.getrandbits(24) << 8
+        ips.update(str(ipaddress.IPv4Address(base | host)) for host in rng.sample(range(1, 255), 6))
+    while len(ips) < size:
+        ips.add(str(ipaddress.IPv4Address(rng.getrandbits(32))))
+    return [[{'field': 'httpRequest.clientIp', 'value': ip}] for ip in list(ips)[:size]]
+
+def spread_over_window(rows, window = 600, seed = 1):
+    # Timestamps inside the handler's default 10 minute window, leaving a margin at both ends
+    rng = random.Random(seed)
+    now = int(time.time())
+    return [(now - window + 5 + rng.randrange(window - 10), row) for row in rows]
+
+class StageTimer:
+    def __init__(self):
+        self.seconds = defaultdict(float)
+
+    def wrap(self, owner, name, stage):
+        method = getattr(owner, name)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.seconds[stage] += time.perf_counter() - start
+        setattr(owner, name, timed)
+
+    def wrap_generator(self, owner, name, stage):
+        # Only the time spent producing items counts, not the handler's work on each item
+        method = getattr(owner, name)
+        def timed(*args, **kwargs):
+            iterator = iter(method(*args, **kwargs))
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    self.seconds[stage] += time.perf_counter() - start
+                yield item
+        setattr(owner, name, timed)
+
+def replay(index, client_registry, timed_rows, vt_url, workers, trace_memory = False):
+    logs = FakeLogsClient(timed_rows)
+    waf = FakeWAFClient()
+    sns = FakeSNSClient()
+    secrets = FakeSecretsClient({'virustotalkey': FakeVirusTotalHandler.api_key})
+    registry = client_registry.ClientRegistry()
+    for service, client in (('logs', logs), ('wafv2', waf), ('sns', sns), ('secretsmanager', secrets)):
+        registry.register(service, client)
+
+    # Fresh wrappers per replay so caches from a previous load do not leak in
+    index.virustotal_url = vt_url
+    index.virustotal_workers = workers
+    index.query_shards = max(1, math.ceil(len(timed_rows) * 1.5 / QUERY_LIMIT))
+    (index.waf_wrapper, index.log_wrapper, index.secret_wrapper, index.vt_wrapper,
+     index.reputation_cache, index.alert_aggregator, index.checkpoint_store, index.client_sns) = index.create_clients_and_wrappers(registry)
+    # LogWrapper resets the root logger to INFO, per-IP logging would dominate the timings
+    logging.getLogger().setLevel(logging.WARNING)
+
+    timer = StageTimer()
+    for name in ('query_logs', 'query_logs_sharded', 'query_ip_counts'):
+        timer.wrap(index.log_wrapper, name, 'query')
+    timer.wrap_generator(index.vt_wrapper, 'lookup_ips', 'virustotal')
+    timer.wrap(index.waf_wrapper, 'get_same_cidr_ips', 'cidr')
+    timer.wrap(index.waf_wrapper, 'update_ip_set_batch', 'ip_set')
+    timer.wrap(index.alert_aggregator, 'publish', 'alerts')
+
+    peak = None
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    index.handler({}, FakeLambdaContext())
+    timer.seconds['total'] = time.perf_counter() - start
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    calls = {}
+    for service, client in (('logs', logs), ('wafv2', waf), ('sns', sns), ('secretsmanager', secrets)):
+        calls.update({f"{service}.{operation}": count for operation, count in client.calls.items()})
+    return timer.seconds, calls, peak, len(waf.addresses)
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type = int, nargs = '+', default = [100, 1000, 10000])
+    parser.add_argument('--recording', help = 'JSON file with recorded get_query_results rows')
+    parser.add_argument('--workers', type = int, default = 16, help = 'concurrent VirusTotal lookups')
+    parser.add_argument('--no-memory', action = 'store_true', help = 'skip the traced run used for peak memory')
+    parser.add_argument('--json', action = 'store_true', help = 'print one JSON object per load')
+    args = parser.parse_args()
+
+    os.environ.update(ENVIRONMENT)
+    import client_registry, index
+
+    if args.recording:
+        with open(args.recording) as fp:
+            loads = [('recording', json.load(fp))]
+    else:
+        loads = [(size, synthetic_rows(size)) for size in args.sizes]
+
+    stages = ('query', 'virustotal', 'cidr', 'ip_set', 'alerts', 'total')
+    if not args.json:
+        print(f"{'load':>10} " + " ".join(f"{stage + ' ms':>14}" for stage in stages) + f" {'peak MB':>9}  ip set  api calls")
+
+    with FakeVirusTotalServer() as vt:
+        for label, rows in loads:
+            timed_rows = spread_over_window(rows)
+            seconds, calls, _, ip_set_size = replay(index, client_registry, timed_rows, vt.url, args.workers)
+            peak = None if args.no_memory else replay(index, client_registry, timed_rows, vt.url, args.workers, trace_memory = True)[2]
+            if args.json:
+                print(json.dumps({'load': label, 'ms': {stage: seconds[stage] * 1000 for stage in stages}, 'calls': calls, 'peak_bytes': peak, 'ip_set_size': ip_set_size}))
+            else:
+                print(f"{label:>10} " + " ".join(f"{seconds[stage] * 1000:14.1f}" for stage in stages)
+                      + (f" {'-':>9}" if peak is None else f" {peak / 2 ** 20:9.1f}") + f"  {ip_set_size:6}  " + ", ".join(f"{name}={count}" for name, count in sorted(calls.items())))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Measures the SNS to Slack relay (lambda/sns_function) against a local fake webhook server.
+
+Compares one POST per SNS record, which is what the relay did before batching, with the
+batched handler. Every --throttle-every'th request is answered with 429 and Retry-After: 0
+to exercise the retry path.
+    python benchmarks/slack_relay.py --records 500
+"""
+import argparse, importlib, json, os, sys, threading, time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+FUNCTION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda', 'sns_function')
+
+class FakeWebhook(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients can keep the connection alive
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    throttle_every = 0
+    lock = threading.Lock()
+    stats = {'requests': 0, 'throttled': 0, 'blocks': 0, 'connections': set()}
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['connections'].add(self.client_address)
+            throttle = self.throttle_every and self.stats['requests'] % self.throttle_every == 0
+            if throttle:
+                self.stats['throttled'] += 1
+            else:
+                self.stats['blocks'] += len(body.get('blocks', [body]))
+        response = b'rate_limited' if throttle else b'ok'
+        self.send_response(429 if throttle else 200)
+        if throttle:
+            self.send_header('Retry-After', '0')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+def sns_event(records, message_size):
+    return {'Records': [{'Sns': {'Message': f"IP: 10.0.{i // 256}.{i % 256} " + 'x' * message_size}} for i in range(records)]}
+
+def measure(name, deliver, event):
+    FakeWebhook.stats.update(requests = 0, throttled = 0, blocks = 0, connections = set())
+    start = time.perf_counter()
+    deliver(event)
+    elapsed = time.perf_counter() - start
+    stats = FakeWebhook.stats
+    print(f"{name:<22} {elapsed * 1000:9.1f} ms  {len(event['Records']) / elapsed:9.0f} msg/s  "
+          f"posts: {stats['requests']:5}  429s: {stats['throttled']:4}  connections: {len(stats['connections'])}")
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type = int, default = 500)
+    parser.add_argument('--message-size', type = int, default = 80)
+    parser.add_argument('--throttle-every', type = int, default = 50)
+    args = parser.parse_args()
+
+    FakeWebhook.throttle_every = args.throttle_every
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeWebhook)
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+
+    os.environ['slack_url'] = f"http://127.0.0.1:{server.server_port}/webhook"
+    sys.path.insert(0, FUNCTION_DIR)
+    relay = importlib.import_module('index')
+    relay.logger.setLevel('WARNING')
+
+    event = sns_event(args.records, args.message_size)
+    # Each record delivered as its own single-record event
+    measure('one post per record', lambda e: [relay.handler({'Records': [record]}, None) for record in e['Records']], event)
+    measure('batched', lambda e: relay.handler(e, None), event)
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
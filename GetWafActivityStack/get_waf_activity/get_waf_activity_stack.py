@@ -7,7 +7,8 @@ from aws_cdk import (
     aws_events as events,
     aws_lambda as lambda_,
     aws_events_targets as targets,
-    aws_iam as iam
+    aws_iam as iam,
+    aws_dynamodb as dynamodb
 
 )
 from constructs import Construct
@@ -27,13 +28,26 @@ class GetWafActivityStack(Stack):
         query = self.node.try_get_context("query")
         secretname = self.node.try_get_context("secretname")
         existinglayer = self.node.try_get_context("existinglayer")
+        virustotal_workers = self.node.try_get_context("virustotal_workers") or "8"
+        # The public API quota, paid keys raise it and 0 disables throttling
+        virustotal_rpm = self.node.try_get_context("virustotal_requests_per_minute")
+        if virustotal_rpm is None:
+            virustotal_rpm = "4"
+        reputation_cache_table = self.node.try_get_context("reputation_cache_table")
+        alert_table = self.node.try_get_context("alert_table")
+        checkpoint_parameter = self.node.try_get_context("checkpoint_parameter")
+        query_limit = self.node.try_get_context("query_limit") or "100"
+        query_shards = self.node.try_get_context("query_shards") or "1"
+        query_mode = self.node.try_get_context("query_mode") or "raw"
+        aggregation_query = self.node.try_get_context("aggregation_query") or ""
 
         # Permissions for lambda functions
         secrets_policy = iam.PolicyStatement(
             effect=iam.Effect.ALLOW, 
             resources=['SECRET-ARN'], 
             actions=[
-            'secretsmanager:GetSecretValue'
+            'secretsmanager:GetSecretValue',
+            'secretsmanager:DescribeSecret'
             ])
         
 
@@ -78,11 +92,54 @@ class GetWafActivityStack(Stack):
                         'sns_topic': (topic.topic_arn),
                         'logGroupName': logGroupName,
                         'query': query,
-                        'secretname': secretname
+                        'secretname': secretname,
+                        'virustotal_workers': str(virustotal_workers),
+                        'virustotal_requests_per_minute': str(virustotal_rpm),
+                        'query_limit': str(query_limit),
+                        'query_shards': str(query_shards),
+                        'query_mode': query_mode,
+                        'aggregation_query': aggregation_query
                         },
             role = (lambda_role),
             layers = [layer]
             )
+
+        # Optional IP reputation cache shared by all containers, items expire through DynamoDB TTL
+        if reputation_cache_table:
+            table = dynamodb.Table(
+                self, "ReputationCacheTable",
+                table_name = reputation_cache_table,
+                partition_key = dynamodb.Attribute(name = "ip", type = dynamodb.AttributeType.STRING),
+                billing_mode = dynamodb.BillingMode.PAY_PER_REQUEST,
+                time_to_live_attribute = "expires_at"
+            )
+            table.grant_read_write_data(lambda_role)
+            lambdaFn.add_environment('reputation_cache_table', table.table_name)
+
+        # Optional "already alerted" store so containers do not repeat each other's alerts
+        if alert_table:
+            alerts = dynamodb.Table(
+                self, "AlertTable",
+                table_name = alert_table,
+                partition_key = dynamodb.Attribute(name = "alert", type = dynamodb.AttributeType.STRING),
+                billing_mode = dynamodb.BillingMode.PAY_PER_REQUEST,
+                time_to_live_attribute = "expires_at"
+            )
+            alerts.grant_read_write_data(lambda_role)
+            lambdaFn.add_environment('alert_table', alerts.table_name)
+
+        # Optional high-water mark for incremental processing, the function creates the parameter on first run
+        if checkpoint_parameter:
+            checkpoint_policy = iam.Policy(self, 'checkpoint_policy', policy_name="checkpoint_policy")
+            checkpoint_policy.add_statements(iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                resources=[self.format_arn(service="ssm", resource="parameter", resource_name=checkpoint_parameter.lstrip('/'))],
+                actions=[
+                'ssm:GetParameter',
+                'ssm:PutParameter'
+                ]))
+            lambda_role.attach_inline_policy(checkpoint_policy)
+            lambdaFn.add_environment('checkpoint_parameter', checkpoint_parameter)
      
 
         # Run every 10 minutes
@@ -0,0 +1,107 @@
+import logging, time
+from collections import OrderedDict
+from dynamodb_batch import batch_call
+
+# SNS rejects messages over 256 KB
+MAX_MESSAGE_BYTES = 250 * 1024
+
+TITLES = OrderedDict([
+    ('malicious', ':rotating-light-red: Malicious or suspicious IPs reported by VirusTotal'),
+    ('same_cidr', ':rotating-light-red: Detected IPs within same CIDR')
+])
+
+class DynamoDBAlertStore:
+    """Remembers alerted keys across containers, items expire through DynamoDB TTL on expires_at."""
+    def __init__(self, dynamodb_client, table_name):
+        self.dynamodb_client = dynamodb_client
+        self.table_name = table_name
+
+    def get_many(self, keys):
+        found, keys, now = set(), list(keys), int(time.time())
+        for start in range(0, len(keys), 100):
+            request = {self.table_name: {'Keys': [{'alert': {'S': key}} for key in keys[start:start + 100]]}}
+            for response in batch_call(self.dynamodb_client.batch_get_item, request, 'UnprocessedKeys'):
+                for item in response['Responses'].get(self.table_name, []):
+                    # TTL deletion is lazy, expired items can still be returned
+                    if int(item['expires_at']['N']) > now:
+                        found.add(item['alert']['S'])
+        return found
+
+    def put_many(self, keys, expires_at):
+        keys = list(keys)
+        for start in range(0, len(keys), 25):
+            request = {self.table_name: [
+                {'PutRequest': {'Item': {'alert': {'S': key}, 'expires_at': {'N': str(expires_at)}}}}
+                for key in keys[start:start + 25]
+            ]}
+            batch_call(self.dynamodb_client.batch_write_item, request, 'UnprocessedItems')
+
+class AlertAggregator:
+    """Collects the findings of one run and publishes the new ones as a single digest."""
+    def __init__(self, ttl = 3600, store = None):
+        self.ttl = ttl
+        self.store = store
+        # Kept across warm invocations: alert key -> expires at
+        self._alerted = {}
+        self._findings = OrderedDict()
+        self.logger = logging.getLogger()
+
+    def reset(self):
+        self._findings = OrderedDict()
+
+    def add(self, kind, key, message):
+        self._findings.setdefault((kind, key), message)
+
+    def _new_findings(self):
+        now = time.time()
+        self._alerted = {key: expires_at for key, expires_at in self._alerted.items() if expires_at > now}
+        keys = [f"{kind}#{key}" for kind, key in self._findings]
+        pending = [key for key in keys if key not in self._alerted]
+        seen = self.store.get_many(pending) if self.store is not None and pending else set()
+        new_keys = set(pending) - seen
+        return [(finding, message) for (finding, message), key in zip(self._findings.items(), keys) if key in new_keys]
+
+    def build_digests(self, findings):
+        sections = OrderedDict((kind, []) for kind in TITLES)
+        for (kind, _), message in findings:
+            sections.setdefault(kind, []).append(message)
+
+        lines = []
+        for kind, messages in sections.items():
+            if messages:
+                lines.append(f"{TITLES.get(kind, kind)} ({len(messages)}):")
+                lines.extend(f"- {message}" for message in messages)
+
+        # One digest unless it would exceed the SNS message size
+        digests, current, size = [], [], 0
+        for line in lines:
+            line_size = len(line.encode('utf-8')) + 1
+            if current and size + line_size > MAX_MESSAGE_BYTES:
+                digests.append("\n".join(current))
+                current, size = [], 0
+            current.append(line)
+            size += line_size
+        if current:
+            digests.append("\n".join(current))
+        return digests
+
+    def publish(self, client_sns, topic_arn, subject = 'Log query results'):
+        findings = self._new_findings()
+        self.logger.info(" --- Alerts -> findings: %s, already alerted: %s --- ", len(self._findings), len(self._findings) - len(findings))
+        self.reset()
+        if not findings:
+            return 0
+
+        for digest in self.build_digests(findings):
+            client_sns.publish(
+                TargetArn = topic_arn,
+                Message = digest,
+                Subject = subject
+            )
+
+        expires_at = int(time.time() + self.ttl)
+        keys = [f"{kind}#{key}" for (kind, key), _ in findings]
+        self._alerted.update(dict.fromkeys(keys, expires_at))
+        if self.store is not None:
+            self.store.put_many(keys, expires_at)
+        return len(findings)
@@ -0,0 +1,40 @@
+import json
+
+class CheckpointStore:
+    """High-water mark of the processed log time and the last query window, kept in an SSM parameter."""
+    def __init__(self, ssm_client, parameter_name, chunk_seconds = 600, max_chunks = 6, lag_seconds = 60, lookback_seconds = 600):
+        self.ssm_client = ssm_client
+        self.parameter_name = parameter_name
+        self.chunk_seconds = chunk_seconds
+        self.max_chunks = max_chunks
+        self.lag_seconds = lag_seconds
+        self.lookback_seconds = lookback_seconds
+
+    def load(self):
+        try:
+            response = self.ssm_client.get_parameter(Name = self.parameter_name)
+        except self.ssm_client.exceptions.ParameterNotFound:
+            return None
+        return json.loads(response['Parameter']['Value'])
+
+    def save(self, start, end):
+        self.ssm_client.put_parameter(
+            Name = self.parameter_name,
+            Value = json.dumps({'end': end, 'window': [start, end]}),
+            Type = 'String',
+            Overwrite = True
+        )
+
+    def plan_windows(self, now):
+        """
+        Splits [high-water mark, now - lag) into chunks of at most chunk_seconds, at most max_chunks per run,
+        so a run after an outage catches up in bounded steps. The first run looks back lookback_seconds.
+        """
+        checkpoint = self.load()
+        end = int(now) - self.lag_seconds
+        start = checkpoint['end'] if checkpoint else end - self.lookback_seconds
+        windows = []
+        while start < end and len(windows) < self.max_chunks:
+            windows.append((start, min(start + self.chunk_seconds, end)))
+            start = windows[-1][1]
+        return windows
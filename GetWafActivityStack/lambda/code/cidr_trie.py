@@ -0,0 +1,64 @@
+import ipaddress
+
+class PrefixTrie:
+    """Binary trie over integer-packed addresses, one root per IP version. Nodes are [zero, one, stored network or None]."""
+    def __init__(self, networks = ()):
+        self._roots = {4: [None, None, None], 6: [None, None, None]}
+        self._networks = set()
+        for network in networks:
+            self.add(network)
+
+    def __len__(self):
+        return len(self._networks)
+
+    def __iter__(self):
+        return iter(self._networks)
+
+    def __contains__(self, network):
+        return self.covers(network)
+
+    @staticmethod
+    def _bits(network):
+        value = int(network.network_address)
+        width = network.max_prefixlen
+        for depth in range(network.prefixlen):
+            yield (value >> (width - 1 - depth)) & 1
+
+    def add(self, network):
+        """Adds a network, returns False when an existing prefix already covers it. Stored prefixes it covers are dropped."""
+        network = ipaddress.ip_network(network, strict = False)
+        node = self._roots[network.version]
+        for bit in self._bits(network):
+            if node[2] is not None:
+                return False
+            if node[bit] is None:
+                node[bit] = [None, None, None]
+            node = node[bit]
+        if node[2] is not None:
+            return False
+        self._prune(node)
+        node[2] = network
+        self._networks.add(network)
+        return True
+
+    def _prune(self, node):
+        # Removes every stored network below node, they are covered by the one stored at node
+        stack = [child for child in node[:2] if child is not None]
+        node[0] = node[1] = None
+        while stack:
+            child = stack.pop()
+            if child[2] is not None:
+                self._networks.discard(child[2])
+            stack.extend(grandchild for grandchild in child[:2] if grandchild is not None)
+
+    def covers(self, network):
+        """True when a stored prefix contains the address or network, walks at most prefixlen nodes."""
+        network = ipaddress.ip_network(network, strict = False)
+        node = self._roots[network.version]
+        for bit in self._bits(network):
+            if node[2] is not None:
+                return True
+            node = node[bit]
+            if node is None:
+                return False
+        return node[2] is not None
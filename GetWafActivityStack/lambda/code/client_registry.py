@@ -0,0 +1,44 @@
+import threading
+
+class LazyClient:
+    """Stands in for a boto3 client and only builds it on first attribute access."""
+    def __init__(self, registry, service_name):
+        self._registry = registry
+        self._service_name = service_name
+
+    def __getattr__(self, name):
+        return getattr(self._registry.get(self._service_name), name)
+
+class ClientRegistry:
+    """Builds each boto3 client on first use from one shared session."""
+    def __init__(self, region_name = None, session = None):
+        self.region_name = region_name
+        self._session = session
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        if self._session is None:
+            # boto3 is only imported once a client is actually needed
+            import boto3
+            self._session = boto3.session.Session()
+        return self._session
+
+    def get(self, service_name):
+        client = self._clients.get(service_name)
+        if client is None:
+            # Sessions are not thread safe, workers may ask for the same client concurrently
+            with self._lock:
+                client = self._clients.get(service_name)
+                if client is None:
+                    client = self.session.client(service_name, region_name = self.region_name)
+                    self._clients[service_name] = client
+        return client
+
+    def register(self, service_name, client):
+        """Uses an existing client (or a local stand-in) for service_name."""
+        self._clients[service_name] = client
+
+    def lazy(self, service_name):
+        return LazyClient(self, service_name)
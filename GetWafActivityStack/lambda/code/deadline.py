@@ -0,0 +1,8 @@
+import time
+
+def deadline_from_context(context, reserve = 0, default = 30):
+    """Returns a time.monotonic() deadline that leaves `reserve` seconds of the Lambda's remaining time unused."""
+    if context is None:
+        return time.monotonic() + default
+    remaining = context.get_remaining_time_in_millis() / 1000.0
+    return time.monotonic() + max(0, remaining - reserve)
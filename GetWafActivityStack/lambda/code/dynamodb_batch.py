@@ -0,0 +1,20 @@
+import logging, random, time
+
+def batch_call(operation, request, unprocessed_key, max_attempts = 5, base_delay = 0.05, max_delay = 2.0):
+    """
+    Calls a DynamoDB batch operation (batch_get_item or batch_write_item) and resends what it left unprocessed,
+    sleeping with exponential backoff and full jitter in between. Returns the responses of every attempt, whatever
+    is still unprocessed after max_attempts is logged and dropped, both stores are best-effort caches.
+    """
+    responses = []
+    for attempt in range(max_attempts):
+        if attempt:
+            # Unprocessed keys mean the table is throttling, resending at once would be throttled again
+            time.sleep(random.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
+        response = operation(RequestItems = request)
+        responses.append(response)
+        request = response.get(unprocessed_key)
+        if not request:
+            return responses
+    logging.getLogger().warning(" --- %s still unprocessed after %s attempts, dropped --- ", unprocessed_key, max_attempts)
+    return responses
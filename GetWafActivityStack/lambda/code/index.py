@@ -1,105 +1,195 @@
-import boto3
+from client_registry import ClientRegistry
 from log_wrapper import LogWrapper
 from secret_wrapper import SecretsWrapper
 from waf_wrapper import WAFWrapper
-import requests
-import os
+from virustotal_wrapper import VirusTotalWrapper, VIRUSTOTAL_URL
+from deadline import deadline_from_context
+from alert_aggregator import AlertAggregator, DynamoDBAlertStore
+from reputation_cache import ReputationCache, DynamoDBReputationStore, FileReputationStore
+from checkpoint import CheckpointStore
+from datetime import datetime
+import os, time
 
 # Environment variables
 sns_topic = os.environ['sns_topic']
 secretname = os.environ['secretname']
 logName = os.environ['logGroupName']
 query_string = os.environ['query']
+query_mode = os.environ.get('query_mode', 'raw')
+aggregation_query = os.environ.get('aggregation_query')
 ip_set_name = os.environ['ip_set_name']
 ip_set_id = os.environ['ip_set_id']
+virustotal_url = os.environ.get('virustotal_url', VIRUSTOTAL_URL)
+virustotal_workers = int(os.environ.get('virustotal_workers', 8))
+virustotal_rpm = int(os.environ.get('virustotal_requests_per_minute', 4))
+query_time_reserve = int(os.environ.get('query_time_reserve', 20))
+lookup_time_reserve = int(os.environ.get('lookup_time_reserve', 10))
+query_limit = int(os.environ.get('query_limit', 100))
+query_shards = int(os.environ.get('query_shards', 1))
+query_max_concurrent = int(os.environ.get('query_max_concurrent', 4))
+cidr_prefix_v4 = int(os.environ.get('cidr_prefix_v4', 24))
+cidr_prefix_v6 = int(os.environ.get('cidr_prefix_v6', 64))
+# Longer than the 10 minute schedule, so consecutive runs share the snapshot. A stale lock token fails the update and refreshes it
+ip_set_snapshot_ttl = int(os.environ.get('ip_set_snapshot_ttl', 3600))
+secret_ttl = int(os.environ.get('secret_ttl', 300))
+reputation_table = os.environ.get('reputation_cache_table')
+reputation_file = os.environ.get('reputation_cache_file')
+alert_table = os.environ.get('alert_table')
+alert_ttl = int(os.environ.get('alert_ttl', 3600))
+checkpoint_parameter = os.environ.get('checkpoint_parameter')
+checkpoint_chunk = int(os.environ.get('checkpoint_chunk', 600))
+checkpoint_max_chunks = int(os.environ.get('checkpoint_max_chunks', 6))
+checkpoint_lag = int(os.environ.get('checkpoint_lag', 60))
+reputation_ttls = {
+    'clean': int(os.environ.get('reputation_ttl_clean', 6 * 3600)),
+    'suspicious': int(os.environ.get('reputation_ttl_suspicious', 3600)),
+    'malicious': int(os.environ.get('reputation_ttl_malicious', 24 * 3600))
+}
 
-# Create clients and wrappers
-def create_clients_and_wrappers():
-    waf_client = boto3.client('wafv2', region_name = 'us-east-1')
-    log_client = boto3.client('logs', region_name = 'us-east-1')
-    secret_client = boto3.client('secretsmanager', region_name = 'us-east-1')
-    client_sns = boto3.client('sns', region_name = 'us-east-1')
+# Create clients and wrappers, each client is only built on first use
+def create_clients_and_wrappers(registry = None):
+    registry = registry or ClientRegistry(region_name = 'us-east-1')
+    waf_client = registry.lazy('wafv2')
+    log_client = registry.lazy('logs')
+    secret_client = registry.lazy('secretsmanager')
+    client_sns = registry.lazy('sns')
 
-    waf_wrapper = WAFWrapper(waf_client)
+    waf_wrapper = WAFWrapper(waf_client, prefix_v4 = cidr_prefix_v4, prefix_v6 = cidr_prefix_v6, snapshot_ttl = ip_set_snapshot_ttl)
     log_wrapper = LogWrapper(log_client)
-    secret_wrapper = SecretsWrapper(secret_client)
+    secret_wrapper = SecretsWrapper(secret_client, ttl = secret_ttl)
+    vt_wrapper = VirusTotalWrapper(
+        base_url = virustotal_url,
+        max_workers = virustotal_workers,
+        requests_per_minute = virustotal_rpm
+    )
 
-    return waf_wrapper, log_wrapper, secret_wrapper, client_sns
+    # Optional second cache tier shared across containers
+    if reputation_table:
+        store = DynamoDBReputationStore(registry.lazy('dynamodb'), reputation_table)
+    elif reputation_file:
+        store = FileReputationStore(reputation_file)
+    else:
+        store = None
+    reputation_cache = ReputationCache(store, ttls = reputation_ttls)
 
-waf_wrapper, log_wrapper, secret_wrapper, client_sns = create_clients_and_wrappers()
+    alert_store = DynamoDBAlertStore(registry.lazy('dynamodb'), alert_table) if alert_table else None
+    alert_aggregator = AlertAggregator(ttl = alert_ttl, store = alert_store)
+
+    checkpoint_store = None
+    if checkpoint_parameter:
+        checkpoint_store = CheckpointStore(registry.lazy('ssm'), checkpoint_parameter, checkpoint_chunk, checkpoint_max_chunks, checkpoint_lag)
+
+    return waf_wrapper, log_wrapper, secret_wrapper, vt_wrapper, reputation_cache, alert_aggregator, checkpoint_store, client_sns
+
+waf_wrapper, log_wrapper, secret_wrapper, vt_wrapper, reputation_cache, alert_aggregator, checkpoint_store, client_sns = create_clients_and_wrappers()
+
+# Only called once a VirusTotal lookup is needed, and with force_refresh after a 401
+def virustotal_api_key(force_refresh = False):
+    return secret_wrapper.get_secrets(secretname, force_refresh = force_refresh)['virustotalkey']
+
+def query_window(deadline, start_time = None, end_time = None):
+    if query_mode == 'aggregate':
+        # Counting and /24 bucketing happen in Logs Insights, rows are (ip, count, prefix)
+        if query_shards > 1:
+            return log_wrapper.query_logs_sharded(logName, aggregation_query, query_shards, query_max_concurrent, deadline, start_time, end_time, query_limit, aggregate = True)
+        return log_wrapper.query_ip_counts(logName, aggregation_query, deadline, start_time, end_time, query_limit)
+    if query_shards > 1:
+        return log_wrapper.query_logs_sharded(logName, query_string, query_shards, query_max_concurrent, deadline, start_time, end_time, query_limit)
+    return log_wrapper.query_logs(logName, query_string, deadline, start_time, end_time, query_limit)
+
+def query_new_logs(deadline):
+    """Queries the windows since the checkpoint (or the last 10 minutes), returns the rows and the fully processed range."""
+    if checkpoint_store is None:
+        return query_window(deadline), None
+
+    windows = checkpoint_store.plan_windows(time.time())
+    log_wrapper.logger.info(" --- Processing windows %s since checkpoint --- ", windows)
+    results, processed = [], None
+    while windows:
+        start, end = windows.pop(0)
+        stopped, truncated = log_wrapper.stopped_queries, log_wrapper.truncated_queries
+        # Windows are half open, Logs Insights includes both ends
+        rows = query_window(deadline, datetime.fromtimestamp(start), datetime.fromtimestamp(end - 1))
+        if log_wrapper.stopped_queries != stopped:
+            results.append(rows)
+            log_wrapper.logger.warning(" --- Window %s-%s is incomplete, it will be queried again next run --- ", start, end)
+            break
+        if log_wrapper.truncated_queries != truncated:
+            if end - start > 1:
+                # Query both halves instead, so rows past the limit are not skipped
+                middle = (start + end) // 2
+                windows[:0] = [(start, middle), (middle, end)]
+                continue
+            log_wrapper.logger.warning(" --- Window %s-%s still hits query_limit at one second, raise query_limit --- ", start, end)
+        results.append(rows)
+        processed = (processed[0] if processed else start, end)
+    return LogWrapper.merge_results(results, aggregate = query_mode == 'aggregate'), processed
 
 def handler(event, context):
     try:
-      virustotal_api_key = secret_wrapper.get_secrets(secretname)
-
-      ips = log_wrapper.query_logs(logName, query_string)
+      # Leave part of the remaining Lambda time for the lookups after the query
+      query_deadline = deadline_from_context(context, reserve = query_time_reserve)
+      rows, processed = query_new_logs(query_deadline)
+      ips = tuple(row.ip for row in rows) if query_mode == 'aggregate' else rows
       log_wrapper.logger.info(" --- Will check this IPs %s. --- ", ips )
       
       if not ips:
          log_wrapper.logger.info(" --- No results to proceed --- ")
+         if processed:
+             checkpoint_store.save(*processed)
          return
       
-      # Get the Virus Total report
-      for ip in ips:
-        response = requests.get(
-            url = f"https://www.virustotal.com/api/v3/ip_addresses/{ip}",
-            headers={
-                'x-apikey': virustotal_api_key['virustotalkey']
-            }
-        )
-
-        if response.status_code == 200:
-            data = response.json()['data']
-            malicious = data['attributes']['last_analysis_stats']['malicious']
-            suspicious = data['attributes']['last_analysis_stats']['suspicious']
-
-            log_wrapper.logger.info("%s report -> malicious: %s, suspicious: %s", data['id'], malicious, suspicious)
-
-            if malicious > 1 or suspicious > 1:
-                message = "IP: %s, Malicious: %s, Suspicious: %s" % (data['id'], malicious, suspicious)
+      # Get the Virus Total reports, handling each verdict as soon as it arrives
+      alert_aggregator.reset()
+      reputation_cache.reset_stats()
+      # Lookups still queued when lookup_time_reserve is reached are cancelled, the rest of the run still needs time
+      lookup_deadline = deadline_from_context(context, reserve = lookup_time_reserve)
+      verdicts = reputation_cache.resolve(ips, lambda misses: vt_wrapper.lookup_ips(misses, virustotal_api_key, lookup_deadline))
+      for verdict in verdicts:
+        if verdict.error is None:
+            log_wrapper.logger.info("%s report -> malicious: %s, suspicious: %s", verdict.ip, verdict.malicious, verdict.suspicious)
+
+            if verdict.malicious > 1 or verdict.suspicious > 1:
+                message = "IP: %s, Malicious: %s, Suspicious: %s" % (verdict.ip, verdict.malicious, verdict.suspicious)
                 
-                log_wrapper.logger.info(" --- Constructing message for %s --- ", data['id'])
-        
-                client_sns.publish(
-                    TargetArn = sns_topic,
-                    Message = message,
-                    Subject = 'Log query results'
-                )
+                log_wrapper.logger.info(" --- Collecting alert for %s --- ", verdict.ip)
+                alert_aggregator.add('malicious', verdict.ip, message)
         
             else:
-                log_wrapper.logger.info(" --- No recorded malicious or suspicious report on virustotal of IP: %s. --- ", ip)  
+                log_wrapper.logger.info(" --- No recorded malicious or suspicious report on virustotal of IP: %s. --- ", verdict.ip)  
         else:
-            try:
-                error_message = response.json()['error']['message']
-                log_wrapper.logger.info(error_message)
-            except Exception as e:
-                log_wrapper.logger.info(f"Failed to get error message from response: {e}")
+            log_wrapper.logger.info(verdict.error)
+
+      reputation_cache.flush()
+      reputation_cache.log_stats()
       
       # If same CIDR ips are found add them to IP set
-      same_cidr_ips = waf_wrapper.get_same_cidr_ips(ips)
+      same_cidr_ips = waf_wrapper.get_same_cidr_ips(rows)
       log_wrapper.logger.info(" --- Detected IPs within same CIDR %s. --- ", same_cidr_ips )
       
       if not same_cidr_ips:
           log_wrapper.logger.info(" --- No IPs with the same CIDR found ---")
+      elif ip_set_id is None:
+          log_wrapper.logger.info(" --- No IP set found --- ")
       else:
-        for ip in same_cidr_ips:
-            if ip_set_id is not None:
-                message = ":rotating-light-red: Detected IPs within same CIDR: %s" % (same_cidr_ips)       
-                client_sns.publish(
-                    TargetArn = sns_topic,
-                    Message = message,
-                    Subject = 'Log query results'
-                )
-                addresses, lock_token = waf_wrapper.check_ip_in_waf(ip, ip_set_id, ip_set_name, scope='CLOUDFRONT')
-                if ip not in addresses:
-                    addresses.append(ip+'/24')
-                    log_wrapper.logger.info(f" --- New IP set addresses {addresses} ---")
-                    log_wrapper.logger.info(f" --- Adding {ip + '/24'} to the IP set {ip_set_name} ---")
-                    waf_wrapper.add_ip_to_waf(addresses, ip_set_id, lock_token, ip_set_name, scope='CLOUDFRONT')
-                else:
-                    log_wrapper.logger.info(f" --- {ip} exists in the IP set ---")
-            else:
-                log_wrapper.logger.info(" --- No IP set found --- ")
+        # One update for the whole batch
+        summary = waf_wrapper.update_ip_set_batch(same_cidr_ips, ip_set_id, ip_set_name, scope='CLOUDFRONT')
+        log_wrapper.logger.info(" --- IP set %s update -> added: %s, skipped: %s, size: %s --- ",
+                                ip_set_name, summary['added'], summary['skipped'], summary['size'])
+        # Nothing added means the IP set is unchanged, no same CIDR findings are published
+        if not summary['added']:
+            log_wrapper.logger.info(" --- Same CIDR IPs already covered by IP set %s --- ", ip_set_name)
+        else:
+            for cidr in same_cidr_ips:
+                status = "added to IP set %s" % ip_set_name if cidr in summary['added'] else "not added to IP set %s" % ip_set_name
+                alert_aggregator.add('same_cidr', cidr, "%s, %s" % (cidr, status))
+
+      # A single digest with the findings not alerted recently
+      alert_aggregator.publish(client_sns, sns_topic)
+
+      # Only advance the high-water mark once the windows are fully handled
+      if processed:
+          checkpoint_store.save(*processed)
 
     except Exception as e:
         log_wrapper.logger.error(" --- Error: %s --- ", str(e))
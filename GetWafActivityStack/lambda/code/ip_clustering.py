@@ -0,0 +1,56 @@
+import socket
+from collections import namedtuple
+import numpy as np
+
+# Parallel arrays, one entry per prefix: network address, hits, distinct IPs and density score
+PrefixClusters = namedtuple('PrefixClusters', ['prefixes', 'hits', 'distinct_ips', 'density'])
+
+def _pack(ip):
+    # inet_pton only accepts exactly four decimal octets, unlike inet_aton which takes shorthand like '6.7.8'
+    try:
+        return socket.inet_pton(socket.AF_INET, ip)
+    except OSError:
+        raise ValueError(f"Invalid IPv4 address: {ip!r}") from None
+
+def pack_ipv4(ips):
+    """Packs dotted-quad strings into a uint32 array, raises ValueError on any malformed entry."""
+    if not ips:
+        return np.zeros(0, dtype = np.uint32)
+    return np.frombuffer(b''.join(map(_pack, ips)), dtype = '>u4').astype(np.uint32)
+
+def _run_starts(values):
+    # Indexes where a sorted array changes value
+    if not len(values):
+        return np.zeros(0, dtype = np.intp)
+    return np.flatnonzero(np.concatenate(([True], values[1:] != values[:-1])))
+
+def cluster_ipv4(packed, prefix_length = 24, counts = None):
+    """
+    Groups packed IPv4 addresses by prefix with one sort and one mask. Returns per-prefix hit counts
+    (weighted by counts when given), distinct-IP counts and density, the share of the prefix's addresses seen.
+    """
+    mask = np.uint32((0xffffffff << (32 - prefix_length)) & 0xffffffff)
+    if counts is None:
+        order = None
+        addresses = np.sort(packed)
+    else:
+        order = np.argsort(packed, kind = 'stable')
+        addresses = packed[order]
+
+    masked = addresses & mask
+    starts = _run_starts(masked)
+    prefixes = masked[starts]
+    if order is None:
+        hits = np.diff(np.append(starts, len(addresses)))
+    else:
+        hits = np.add.reduceat(np.asarray(counts, dtype = np.int64)[order], starts) if len(starts) else np.zeros(0, dtype = np.int64)
+
+    # Every prefix holds at least one distinct address, so the runs line up with prefixes
+    distinct = addresses[_run_starts(addresses)]
+    distinct_masked = distinct & mask
+    distinct_ips = np.diff(np.append(_run_starts(distinct_masked), len(distinct)))
+    density = distinct_ips / float(2 ** (32 - prefix_length))
+    return PrefixClusters(prefixes, hits, distinct_ips, density)
+
+def prefix_to_cidr(prefix, prefix_length = 24):
+    return f"{socket.inet_ntoa(int(prefix).to_bytes(4, 'big'))}/{prefix_length}"
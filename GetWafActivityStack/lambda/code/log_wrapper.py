@@ -1,58 +1,155 @@
-import boto3, logging, time, datetime
+import logging, random, threading, time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
+# Row of an aggregation query, prefix is None when the query does not bucket by /24
+IPCount = namedtuple('IPCount', ['ip', 'count', 'prefix'])
+
+# Statuses after which get_query_results will not return anything new
+FAILED_STATUSES = ('Failed', 'Cancelled', 'Timeout', 'Unknown')
+
 class LogWrapper:
     def __init__(self, log_client, instance = None):
         self.log_client = log_client
         self.instance = instance
 
+        # Queries cut short by a deadline or by the result limit, lets callers tell partial results apart
+        self.stopped_queries = 0
+        self.truncated_queries = 0
+        self._lock = threading.Lock()
+
         self.logger = logging.getLogger()
         logging.basicConfig()
         self.logger.setLevel(logging.INFO)
 
     @classmethod
     def from_resource(cls):
+        import boto3
         log_client = boto3.client('logs')
         return cls(log_client)
 
-    def query_logs(self, logName, query_string):
+    def poll_query(self, query_id, deadline, initial_delay = 0.25, max_delay = 4.0):
+        """Yields the result records once the query completes, stopping it and yielding its final snapshot if the deadline is hit."""
+        delay = initial_delay
+        while True:
+            # Partial results are not append-only, rows can be re-sorted or replaced until the query completes
+            response = self.log_client.get_query_results(queryId = query_id)
+            status = response['status']
+            if status == 'Complete':
+                self.logger.info(' --- Query %s complete, number of results: %s --- ', query_id, len(response['results']))
+                yield from response['results']
+                return
+            if status in FAILED_STATUSES:
+                raise Exception(f" --- Query {query_id} ended with status {status} --- ")
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                yield from self.stop_and_collect(query_id)
+                return
+
+            # Exponential backoff with jitter, never sleeping past the deadline
+            time.sleep(min(remaining, delay / 2 + random.uniform(0, delay / 2)))
+            delay = min(max_delay, delay * 2)
+
+    def stop_and_collect(self, query_id):
+        """Stops a query and returns the results it had found, deduplicated on @ptr."""
+        try:
+            self.log_client.stop_query(queryId = query_id)
+        except self.log_client.exceptions.InvalidParameterException:
+            # The query finished between the last poll and the stop
+            pass
+        with self._lock:
+            self.stopped_queries += 1
+
+        records, seen = [], set()
+        for record in self.log_client.get_query_results(queryId = query_id)['results']:
+            ptr = next((field['value'] for field in record if field['field'] == '@ptr'), None)
+            if ptr is not None:
+                if ptr in seen:
+                    continue
+                seen.add(ptr)
+            records.append(record)
+        self.logger.warning(' --- Deadline hit, stopped query %s after %s results --- ', query_id, len(records))
+        return records
+
+    def check_limit(self, records, limit):
+        """Counts a query as truncated when it returned as many records as its limit, the rest of the window was not read."""
+        if len(records) >= limit:
+            with self._lock:
+                self.truncated_queries += 1
+            self.logger.warning(' --- Query hit the result limit of %s, results are incomplete --- ', limit)
+
+    def iter_query_logs(self, logName, query_string, deadline, start_time = None, end_time = None, limit = 100):
+        self.logger.info(" --- Start query --- ")
+        end_time = end_time or datetime.now()
+        start_time = start_time or end_time - timedelta(minutes = 10)
+
+        result = self.log_client.start_query(
+            logGroupName = logName,
+            startTime = int(start_time.timestamp()),
+            endTime = int(end_time.timestamp()),
+            queryString = query_string,
+            limit = limit
+        )
+        return self.poll_query(result['queryId'], deadline)
+
+    def query_logs(self, logName, query_string, deadline = None, start_time = None, end_time = None, limit = 100):
         try:
-            self.logger.info(" --- Start query --- ")
-
-            result = self.log_client.start_query(
-                logGroupName = logName,
-                startTime = int((datetime.today() - timedelta(minutes = 10)).timestamp()),
-                endTime = int(datetime.now().timestamp()),
-                queryString = query_string,
-                limit = 100
-            )
-
-            self.logger.info(' --- Sleeping --- ')
-
-            tries = 30
-            total_sleep_time = 0
-            self.logger.info(' --- Getting results --- ')
-            response = self.log_client.get_query_results(
-                queryId = result['queryId']
-            )
-            while(not response['results'] and tries > 0):
-                response = self.log_client.get_query_results(
-                    queryId = result['queryId']
-                )
-
-                time.sleep(0.5)
-                total_sleep_time += 0.5
-                tries -= 1
-
-            if(not response['results']):
-                raise Exception(" --- No results found --- ")
-
-            self.logger.info(" --- Function slept for a total of %s seconds.--- ", total_sleep_time)
-            self.logger.info(' --- Number of results: %s --- ' % (len(response['results'])))
-
-            ips = [record['value'] for sublist in response['results'] for record in sublist if record['field'] == 'httpRequest.clientIp']
+            if deadline is None:
+                deadline = time.monotonic() + 30
+            records = list(self.iter_query_logs(logName, query_string, deadline, start_time, end_time, limit))
+            self.check_limit(records, limit)
+            ips = [record['value'] for sublist in records for record in sublist if record['field'] == 'httpRequest.clientIp']
             return tuple(ips)
 
         except Exception:
             self.logger.error(" --- Error! --- ")
             raise
+
+    def query_ip_counts(self, logName, query_string, deadline = None, start_time = None, end_time = None, limit = 100):
+        """Runs a `stats count(*) as hits by clientIp, prefix` query and returns one IPCount per client IP."""
+        try:
+            if deadline is None:
+                deadline = time.monotonic() + 30
+            records = list(self.iter_query_logs(logName, query_string, deadline, start_time, end_time, limit))
+            self.check_limit(records, limit)
+            rows = []
+            for record in records:
+                fields = {field['field']: field['value'] for field in record}
+                rows.append(IPCount(fields['clientIp'], int(fields['hits']), fields.get('prefix')))
+            return tuple(rows)
+
+        except Exception:
+            self.logger.error(" --- Error! --- ")
+            raise
+
+    def query_logs_sharded(self, logName, query_string, shards, max_concurrent = 4, deadline = None, start_time = None, end_time = None, limit = 100, aggregate = False):
+        """Splits the window into time shards queried concurrently, so each shard gets its own result limit."""
+        if deadline is None:
+            deadline = time.monotonic() + 30
+        end_time = end_time or datetime.now()
+        start_time = start_time or end_time - timedelta(minutes = 10)
+        step = (end_time - start_time) / shards
+        windows = [(start_time + step * i, start_time + step * (i + 1)) for i in range(shards)]
+
+        # Logs Insights limits concurrent queries per account, keep the pool well below it
+        query = self.query_ip_counts if aggregate else self.query_logs
+        with ThreadPoolExecutor(max_workers = min(max_concurrent, shards)) as executor:
+            results = list(executor.map(lambda window: query(logName, query_string, deadline, window[0], window[1], limit), windows))
+
+        merged = self.merge_results(results, aggregate)
+        self.logger.info(' --- Merged %s shards into %s unique results --- ', shards, len(merged))
+        return merged
+
+    @staticmethod
+    def merge_results(results, aggregate = False):
+        """Merges results of several windows, summing IPCount rows per IP or dropping duplicate IPs in order."""
+        if aggregate:
+            merged = {}
+            for row in (row for window_rows in results for row in window_rows):
+                previous = merged.get(row.ip)
+                merged[row.ip] = row if previous is None else row._replace(count = previous.count + row.count)
+            return tuple(merged.values())
+        # Shard boundaries overlap by up to a second
+        return tuple(dict.fromkeys(ip for window_ips in results for ip in window_ips))
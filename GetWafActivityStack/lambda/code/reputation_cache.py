@@ -0,0 +1,139 @@
+import json, logging, os, time
+from collections import OrderedDict
+from virustotal_wrapper import Verdict
+from dynamodb_batch import batch_call
+
+DEFAULT_TTLS = {'clean': 6 * 3600, 'suspicious': 3600, 'malicious': 24 * 3600}
+
+def classify(verdict):
+    if verdict.malicious > 1:
+        return 'malicious'
+    if verdict.suspicious > 1:
+        return 'suspicious'
+    return 'clean'
+
+class DynamoDBReputationStore:
+    def __init__(self, dynamodb_client, table_name):
+        self.dynamodb_client = dynamodb_client
+        self.table_name = table_name
+
+    def get_many(self, ips):
+        entries = {}
+        ips = list(ips)
+        for start in range(0, len(ips), 100):
+            request = {self.table_name: {'Keys': [{'ip': {'S': ip}} for ip in ips[start:start + 100]]}}
+            for response in batch_call(self.dynamodb_client.batch_get_item, request, 'UnprocessedKeys'):
+                for item in response['Responses'].get(self.table_name, []):
+                    entries[item['ip']['S']] = (int(item['malicious']['N']), int(item['suspicious']['N']), int(item['expires_at']['N']))
+        return entries
+
+    def put_many(self, entries):
+        items = list(entries.items())
+        for start in range(0, len(items), 25):
+            request = {self.table_name: [
+                {'PutRequest': {'Item': {
+                    'ip': {'S': ip},
+                    'malicious': {'N': str(malicious)},
+                    'suspicious': {'N': str(suspicious)},
+                    'expires_at': {'N': str(expires_at)}
+                }}}
+                for ip, (malicious, suspicious, expires_at) in items[start:start + 25]
+            ]}
+            batch_call(self.dynamodb_client.batch_write_item, request, 'UnprocessedItems')
+
+class FileReputationStore:
+    def __init__(self, path):
+        self.path = path
+        self._entries = None
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self.path) as fp:
+                    self._entries = {ip: tuple(entry) for ip, entry in json.load(fp).items()}
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def get_many(self, ips):
+        entries = self._load()
+        return {ip: entries[ip] for ip in ips if ip in entries}
+
+    def put_many(self, entries):
+        stored = self._load()
+        now = int(time.time())
+        for ip in [ip for ip, entry in stored.items() if entry[2] <= now]:
+            del stored[ip]
+        stored.update(entries)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as fp:
+            json.dump(stored, fp)
+        os.replace(tmp_path, self.path)
+
+class ReputationCache:
+    def __init__(self, store = None, max_entries = 10000, ttls = None):
+        self.store = store
+        self.max_entries = max_entries
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self._entries = OrderedDict()
+        self._pending = {}
+        self.logger = logging.getLogger()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {'memory_hits': 0, 'store_hits': 0, 'misses': 0}
+
+    def _remember(self, ip, entry):
+        self._entries[ip] = entry
+        self._entries.move_to_end(ip)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last = False)
+
+    def get_many(self, ips):
+        """Returns cached verdicts keyed by IP and the list of IPs that still need a lookup."""
+        now = int(time.time())
+        verdicts, pending = {}, []
+        for ip in ips:
+            entry = self._entries.get(ip)
+            if entry is not None and entry[2] > now:
+                self._entries.move_to_end(ip)
+                verdicts[ip] = Verdict(ip, entry[0], entry[1], 200, None)
+                self.stats['memory_hits'] += 1
+            else:
+                pending.append(ip)
+
+        if pending and self.store is not None:
+            for ip, entry in self.store.get_many(pending).items():
+                if entry[2] > now:
+                    self._remember(ip, entry)
+                    verdicts[ip] = Verdict(ip, entry[0], entry[1], 200, None)
+                    self.stats['store_hits'] += 1
+
+        misses = [ip for ip in pending if ip not in verdicts]
+        self.stats['misses'] += len(misses)
+        return verdicts, misses
+
+    def put(self, verdict):
+        if verdict.error is not None:
+            return
+        entry = (verdict.malicious, verdict.suspicious, int(time.time()) + self.ttls[classify(verdict)])
+        self._remember(verdict.ip, entry)
+        self._pending[verdict.ip] = entry
+
+    def resolve(self, ips, fetch):
+        """Yields cached verdicts first, then the verdicts produced by fetch(misses), caching the new ones."""
+        verdicts, misses = self.get_many(ips)
+        yield from verdicts.values()
+        if misses:
+            for verdict in fetch(misses):
+                self.put(verdict)
+                yield verdict
+
+    def flush(self):
+        if self._pending and self.store is not None:
+            self.store.put_many(self._pending)
+        self._pending = {}
+
+    def log_stats(self):
+        self.logger.info(" --- Reputation cache -> memory hits: %s, store hits: %s, misses: %s --- ",
+                         self.stats['memory_hits'], self.stats['store_hits'], self.stats['misses'])
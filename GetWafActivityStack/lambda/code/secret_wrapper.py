@@ -1,21 +1,47 @@
-import boto3, json
+import json, threading, time
 
 class SecretsWrapper:
-    def __init__(self, secret_client, instance = None):
+    def __init__(self, secret_client, instance = None, ttl = 300, stale_ttl = 3600):
         self.secret_client = secret_client
         self.instance = instance
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        # (secretId, version stage) -> [value, version id, fetched at]
         self._cache = {}
+        self._lock = threading.Lock()
 
     @classmethod
     def from_resource(cls):
+        import boto3
         secret_client = boto3.client('secretsmanager')
         return cls(secret_client)
 
-    def get_secrets(self, secretId):
-        if secretId not in self._cache:
-            try:
-                _secret = json.loads(self.secret_client.get_secret_value(SecretId = secretId)['SecretString'])
-                self._cache[secretId] = _secret
-            except Exception as e:
-                raise e
-        return self._cache[secretId]
+    def _fetch(self, secretId, version_stage):
+        response = self.secret_client.get_secret_value(SecretId = secretId, VersionStage = version_stage)
+        entry = [json.loads(response['SecretString']), response['VersionId'], time.monotonic()]
+        self._cache[(secretId, version_stage)] = entry
+        return entry
+
+    def _revalidate(self, secretId, version_stage, entry):
+        # describe_secret is enough to tell whether the stage moved to a new version after a rotation
+        try:
+            stages = self.secret_client.describe_secret(SecretId = secretId)['VersionIdsToStages']
+        except Exception:
+            # Keep serving the stale value, the next call past stale_ttl fetches without describing first
+            return entry
+        version_id = next((version for version, labels in stages.items() if version_stage in labels), None)
+        if entry[1] != version_id:
+            return self._fetch(secretId, version_stage)
+        entry[2] = time.monotonic()
+        return entry
+
+    def get_secrets(self, secretId, version_stage = 'AWSCURRENT', force_refresh = False):
+        key = (secretId, version_stage)
+        # Revalidated inline, a background thread would not run while Lambda freezes the sandbox between invocations
+        with self._lock:
+            entry = self._cache.get(key)
+            if force_refresh or entry is None or time.monotonic() - entry[2] > self.stale_ttl:
+                entry = self._fetch(secretId, version_stage)
+            elif time.monotonic() - entry[2] > self.ttl:
+                entry = self._revalidate(secretId, version_stage, entry)
+            return entry[0]
@@ -0,0 +1,107 @@
+import json, logging, threading, time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
+import urllib3
+
+VIRUSTOTAL_URL = 'https://www.virustotal.com/api/v3'
+
+Verdict = namedtuple('Verdict', ['ip', 'malicious', 'suspicious', 'status_code', 'error'])
+
+class TokenBucket:
+    def __init__(self, rate, per = 60.0, capacity = None):
+        self.rate = rate
+        self.per = per
+        self.capacity = capacity or rate
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate / self.per)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) * self.per / self.rate
+            time.sleep(wait)
+
+class VirusTotalWrapper:
+    def __init__(self, http = None, base_url = VIRUSTOTAL_URL, max_workers = 8, requests_per_minute = None, timeout = 10):
+        self.base_url = base_url.rstrip('/')
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.http = http or self.create_pool(max_workers)
+        # The bucket lives as long as the wrapper, so the quota is shared by warm invocations
+        self.bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+
+        self.logger = logging.getLogger()
+
+    @staticmethod
+    def create_pool(pool_size):
+        # One keep-alive connection per worker, the handler does its own error handling
+        return urllib3.PoolManager(num_pools = 1, maxsize = pool_size, block = True, retries = False)
+
+    def get_ip_report(self, ip, api_key):
+        if self.bucket is not None:
+            self.bucket.acquire()
+        response = self.http.request(
+            'GET',
+            f"{self.base_url}/ip_addresses/{ip}",
+            headers = {'x-apikey': api_key},
+            timeout = self.timeout
+        )
+
+        if response.status == 200:
+            stats = json.loads(response.data)['data']['attributes']['last_analysis_stats']
+            return Verdict(ip, stats['malicious'], stats['suspicious'], response.status, None)
+
+        try:
+            error_message = json.loads(response.data)['error']['message']
+        except Exception as e:
+            error_message = f"Failed to get error message from response: {e}"
+        return Verdict(ip, None, None, response.status, error_message)
+
+    def lookup_ips(self, ips, api_key, deadline = None):
+        """
+        Yields a Verdict per IP in completion order, so callers can act before the batch ends.
+        api_key is either the key or a callable taking force_refresh, which is only called once a
+        lookup is needed and called again with force_refresh=True when VirusTotal answers 401.
+        Lookups not started by the time.monotonic() deadline, or when the caller stops iterating, are cancelled.
+        """
+        lock = threading.Lock()
+        current = {'key': None}
+
+        def resolve_key(stale = None):
+            with lock:
+                # Another worker may already have refreshed the rejected key
+                if current['key'] is None or current['key'] == stale:
+                    current['key'] = api_key(force_refresh = stale is not None) if callable(api_key) else api_key
+                return current['key']
+
+        def lookup(ip):
+            key = resolve_key()
+            verdict = self.get_ip_report(ip, key)
+            if verdict.status_code == 401 and callable(api_key):
+                verdict = self.get_ip_report(ip, resolve_key(stale = key))
+            return verdict
+
+        executor = ThreadPoolExecutor(max_workers = self.max_workers)
+        futures = {executor.submit(lookup, ip): ip for ip in ips}
+        timeout = None if deadline is None else max(0, deadline - time.monotonic())
+        try:
+            for future in as_completed(futures, timeout = timeout):
+                try:
+                    yield future.result()
+                except Exception as e:
+                    yield Verdict(futures[future], None, None, None, str(e))
+        except TimeoutError:
+            pending = [ip for future, ip in futures.items() if not future.done()]
+            self.logger.warning(" --- Deadline hit, %s VirusTotal lookups not done --- ", len(pending))
+            for ip in pending:
+                yield Verdict(ip, None, None, None, "Lookup skipped, deadline reached")
+        finally:
+            # Runs on GeneratorExit too, so an early stop does not wait for the queued lookups
+            executor.shutdown(wait = False, cancel_futures = True)
@@ -1,24 +1,106 @@
-import boto3
+import ipaddress, logging, random, time
 from collections import Counter
+from cidr_trie import PrefixTrie
+
+_ip_clustering = False
+
+def load_ip_clustering():
+    # Imported on first use, so invocations without IPs don't pay for numpy on a cold start.
+    # None when numpy is not in the layer, same-CIDR detection counts in Python instead
+    global _ip_clustering
+    if _ip_clustering is False:
+        try:
+            import ip_clustering
+        except ImportError:
+            ip_clustering = None
+        _ip_clustering = ip_clustering
+    return _ip_clustering
+
+# WAF quota for addresses in a single IP set
+IP_SET_ADDRESS_LIMIT = 10000
+
+class IPSetSnapshot:
+    """Addresses of an IP set as of one lock token, indexed for membership checks."""
+    def __init__(self, addresses, version, lock_token):
+        self.addresses = list(addresses)
+        self.version = version
+        self.lock_token = lock_token
+        self.fetched_at = time.monotonic()
+        self._index = frozenset(ipaddress.ip_network(address, strict = False) for address in self.addresses)
+        self._trie = PrefixTrie(self._index)
+
+    def __contains__(self, cidr):
+        return ipaddress.ip_network(cidr, strict = False) in self._index
+
+    def covers(self, cidr):
+        return cidr in self or self._trie.covers(cidr)
 
 class WAFWrapper:
-    def __init__(self, waf_client):
+    def __init__(self, waf_client, prefix_v4 = 24, prefix_v6 = 64, min_ips = 4, snapshot_ttl = 3600):
         self.waf_client = waf_client
+        self.prefix_lengths = {4: prefix_v4, 6: prefix_v6}
+        self.min_ips = min_ips
+        self.snapshot_ttl = snapshot_ttl
+        # Kept across warm invocations, keyed by (id, scope); each snapshot carries its lock token
+        self._snapshots = {}
+        self.logger = logging.getLogger()
 
     @classmethod
     def from_resource(cls):
+        import boto3
         waf_client = boto3.client('wafv2')
         return cls(waf_client)
 
     def get_cidr(self, ip):
-        return ".".join(ip.split(".")[:3])
+        address = ipaddress.ip_address(ip)
+        return str(ipaddress.ip_network((address, self.prefix_lengths[address.version]), strict = False))
+
+    def cluster_ips(self, ips):
+        """
+        Per-prefix hits, distinct IPs and density for the IPv4 entries of ips (strings or (ip, count, prefix)
+        rows), computed in one vectorized pass. Returns the clusters and the non-IPv4 entries left over.
+        """
+        # Callers pass either all strings or all rows, split with comprehensions to keep 1M entries cheap
+        ips = list(ips)
+        if ips and not isinstance(ips[0], str):
+            rows = [row for row in ips if ':' not in row[0]]
+            others = [row for row in ips if ':' in row[0]]
+            ipv4, counts = [row[0] for row in rows], [row[1] for row in rows]
+        else:
+            ipv4 = [ip for ip in ips if ':' not in ip]
+            others = [ip for ip in ips if ':' in ip]
+            counts = None
+        ip_clustering = load_ip_clustering()
+        clusters = ip_clustering.cluster_ipv4(ip_clustering.pack_ipv4(ipv4), self.prefix_lengths[4], counts) if ipv4 else None
+        return clusters, others
 
     def get_same_cidr_ips(self, ips):
-        cidrs = [self.get_cidr(ip) for ip in ips]
-        counter = Counter(cidrs)
-        same_cidr_ips = [ip + ".0" for ip, count in counter.items() if count > 3]
+        ip_clustering = load_ip_clustering()
+        if ip_clustering is None:
+            return self.count_same_cidr_ips(ips)
+
+        clusters, others = self.cluster_ips(ips)
+        same_cidr_ips = []
+        if clusters is not None:
+            selected = clusters.distinct_ips >= self.min_ips
+            same_cidr_ips = [ip_clustering.prefix_to_cidr(prefix, self.prefix_lengths[4]) for prefix in clusters.prefixes[selected]]
+        return same_cidr_ips + self.count_same_cidr_ips(others)
+
+    def count_same_cidr_ips(self, ips):
+        # Accepts plain IP strings or pre-aggregated (ip, count, prefix) rows. Like the numpy path a prefix
+        # qualifies on distinct IPs, so repeated entries of one IP count once.
+        # The server-side prefix is the first three octets, only usable while IPv4 is bucketed by /24.
+        server_prefix = self.prefix_lengths[4] == 24
+        distinct = {
+            (self.get_cidr(ip), ip) if isinstance(ip, str)
+            else (ip[2] + '.0/24', ip[0]) if server_prefix and ip[2]
+            else (self.get_cidr(ip[0]), ip[0])
+            for ip in ips
+        }
+        counter = Counter(cidr for cidr, _ in distinct)
+        same_cidr_ips = [cidr for cidr, count in counter.items() if count >= self.min_ips]
         return same_cidr_ips
-    
+
     def get_ip_set_id(self, name, scope='CLOUDFRONT'):
         response = self.waf_client.list_ip_sets(Scope=scope)
         for ip_set in response['IPSets']:
@@ -26,15 +108,95 @@ class WAFWrapper:
                 return ip_set['Id']
         return None
 
-    def check_ip_in_waf(self, ip, ip_set_id, name, scope='CLOUDFRONT'):
+    def get_ip_set(self, ip_set_id, name, scope='CLOUDFRONT'):
         response = self.waf_client.get_ip_set(Id=ip_set_id, Name=name, Scope=scope)
-        return response['IPSet']['Addresses'], response['LockToken']
+        return response['IPSet'], response['LockToken']
+
+    def get_snapshot(self, ip_set_id, name, scope='CLOUDFRONT', refresh = False):
+        """Returns the cached snapshot, calling get_ip_set only when forced or older than snapshot_ttl."""
+        snapshot = self._snapshots.get((ip_set_id, scope))
+        if refresh or snapshot is None or time.monotonic() - snapshot.fetched_at > self.snapshot_ttl:
+            ip_set, lock_token = self.get_ip_set(ip_set_id, name, scope)
+            # An IP set holds a single address version
+            version = 6 if ip_set.get('IPAddressVersion') == 'IPV6' else 4
+            snapshot = IPSetSnapshot(ip_set['Addresses'], version, lock_token)
+            self._snapshots[(ip_set_id, scope)] = snapshot
+        return snapshot
+
+    def check_ip_in_waf(self, ip, ip_set_id, name, scope='CLOUDFRONT'):
+        snapshot = self.get_snapshot(ip_set_id, name, scope)
+        return list(snapshot.addresses), snapshot.lock_token
 
     def add_ip_to_waf(self, addresses, ip_set_id, lock_token, name, scope='CLOUDFRONT'):
-        self.waf_client.update_ip_set(
+        response = self.waf_client.update_ip_set(
             Name=name,
             Scope=scope,
             Id=ip_set_id,
             Addresses=addresses,
             LockToken=lock_token
         )
+        # The update returns the next lock token, so the snapshot stays current without a get_ip_set
+        previous = self._snapshots.get((ip_set_id, scope))
+        version = previous.version if previous else 4
+        self._snapshots[(ip_set_id, scope)] = IPSetSnapshot(addresses, version, response['NextLockToken'])
+
+    @staticmethod
+    def collapse_to_limit(networks, max_addresses):
+        """Widens the most specific prefixes one bit at a time until the networks fit in max_addresses entries."""
+        groups = {4: [], 6: []}
+        for network in networks:
+            groups[network.version].append(network)
+        for version in groups:
+            groups[version] = list(ipaddress.collapse_addresses(groups[version]))
+
+        while sum(len(group) for group in groups.values()) > max_addresses:
+            version = max(groups, key = lambda v: len(groups[v]))
+            longest = max(network.prefixlen for network in groups[version])
+            groups[version] = list(ipaddress.collapse_addresses(
+                network.supernet(new_prefix = longest - 1) if network.prefixlen == longest else network
+                for network in groups[version]
+            ))
+        return groups[4] + groups[6]
+
+    def merge_addresses(self, addresses, cidrs, version = None, max_addresses = IP_SET_ADDRESS_LIMIT):
+        """
+        Returns the merged IP set addresses and the CIDRs that were not already covered. Existing entries are
+        kept as they are, the set is only collapsed when the new CIDRs would push it over max_addresses.
+        """
+        trie = PrefixTrie(addresses)
+        added = [cidr for cidr in cidrs if (version is None or ipaddress.ip_network(cidr).version == version) and trie.add(cidr)]
+        merged = list(addresses) + added
+        if len(merged) > max_addresses:
+            merged = [str(network) for network in self.collapse_to_limit(trie, max_addresses)]
+        return merged, added
+
+    def update_ip_set_batch(self, cidrs, ip_set_id, name, scope='CLOUDFRONT', max_addresses = IP_SET_ADDRESS_LIMIT, retries = 3):
+        """Applies all CIDRs with one update_ip_set, re-fetching and re-merging when the lock token is stale."""
+        snapshot = self.get_snapshot(ip_set_id, name, scope)
+        for attempt in range(retries + 1):
+            pending = [cidr for cidr in cidrs if ipaddress.ip_network(cidr).version == snapshot.version and not snapshot.covers(cidr)]
+            summary = {
+                'added': pending,
+                'skipped': [cidr for cidr in cidrs if cidr not in pending],
+                'size': len(snapshot.addresses)
+            }
+            # Nothing new, no API call at all
+            if not pending:
+                return summary
+
+            merged, added = self.merge_addresses(snapshot.addresses, pending, snapshot.version, max_addresses)
+            summary['added'] = added
+            summary['skipped'] = [cidr for cidr in cidrs if cidr not in added]
+            summary['size'] = len(merged)
+            # Every CIDR was covered by another one of the batch, the set is unchanged
+            if not added:
+                return summary
+            try:
+                self.add_ip_to_waf(merged, ip_set_id, snapshot.lock_token, name, scope)
+                return summary
+            except self.waf_client.exceptions.WAFOptimisticLockException:
+                if attempt == retries:
+                    raise
+                self.logger.warning(" --- IP set %s changed during update, retrying --- ", name)
+                time.sleep(random.uniform(0, 0.2 * 2 ** attempt))
+                snapshot = self.get_snapshot(ip_set_id, name, scope, refresh = True)
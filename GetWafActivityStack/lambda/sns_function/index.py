@@ -5,25 +5,65 @@ logger = logging.getLogger()
 logging.basicConfig()
 logger.setLevel(logging.INFO)
 
-http = urllib3.PoolManager()
+# Slack accepts at most 50 blocks per message and 3000 characters per section text
+MAX_BLOCKS = 50
+MAX_TEXT = 3000
+MAX_PAYLOAD = 40000
+
+# 429 (and 503) responses are retried after the Retry-After delay, other failures back off exponentially
+retries = urllib3.Retry(
+  total = 5,
+  status_forcelist = [429, 503],
+  allowed_methods = frozenset(['POST']),
+  backoff_factor = 0.5,
+  respect_retry_after_header = True,
+  raise_on_status = False
+)
+http = urllib3.PoolManager(
+  retries = retries,
+  headers = {'Connection': 'keep-alive', 'Content-Type': 'application/json'}
+)
 env_url = os.environ['slack_url']
 logger.info("Slack url: %s.", env_url)
 
+def build_batches(messages):
+  """Coalesces messages into lists of section blocks that fit in one Slack payload."""
+  batches, blocks, size = [], [], 0
+  for message in messages:
+    for start in range(0, max(len(message), 1), MAX_TEXT):
+      block = {'type': 'section', 'text': {'type': 'mrkdwn', 'text': message[start:start + MAX_TEXT] or ' '}}
+      block_size = len(json.dumps(block))
+      if blocks and (len(blocks) == MAX_BLOCKS or size + block_size > MAX_PAYLOAD):
+        batches.append(blocks)
+        blocks, size = [], 0
+      blocks.append(block)
+      size += block_size
+  if blocks:
+    batches.append(blocks)
+  return batches
+
 def handler(event, context):
   url = env_url
-  msg = {
-    "text": event['Records'][0]['Sns']['Message']
-  }
-  logger.info("Constructing message %s.", msg)
-  encoded_msg = json.dumps(msg).encode('utf-8')
+  messages = [record['Sns']['Message'] for record in event['Records']]
+  batches = build_batches(messages)
+  logger.info("Relaying %s messages in %s Slack posts.", len(messages), len(batches))
   try:
-    resp = http.request('POST',url, body=encoded_msg)
-    logger.info(
-        'message: %s, status_code: %s, response: %s',
-        event['Records'][0]['Sns']['Message'],
-        resp.status,
-        resp.data
-)
+    for blocks in batches:
+      msg = {
+        # Fallback used by Slack notifications
+        "text": blocks[0]['text']['text'],
+        "blocks": blocks
+      }
+      encoded_msg = json.dumps(msg).encode('utf-8')
+      resp = http.request('POST', url, body=encoded_msg)
+      logger.info(
+          'blocks: %s, status_code: %s, response: %s',
+          len(blocks),
+          resp.status,
+          resp.data
+      )
+      if resp.status >= 400:
+        raise Exception("Slack returned %s: %s" % (resp.status, resp.data))
   except Exception:
     logger.error("Error")
     raise
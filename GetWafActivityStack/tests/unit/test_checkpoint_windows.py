@@ -0,0 +1,31 @@
+import os, sys, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', '..', 'lambda', 'code'))
+sys.path.insert(0, os.path.join(HERE, '..', '..', 'benchmarks'))
+
+for name, value in (('sns_topic', 'test'), ('secretname', 'test'), ('logGroupName', 'test'), ('query', 'fields httpRequest.clientIp'),
+                    ('ip_set_name', 'test'), ('ip_set_id', 'test')):
+    os.environ.setdefault(name, value)
+
+import index
+from fakes import FakeLogsClient
+from log_wrapper import LogWrapper
+
+class FixedWindows:
+    def __init__(self, windows):
+        self.windows = windows
+
+    def plan_windows(self, now):
+        return list(self.windows)
+
+def test_window_hitting_the_limit_is_split(monkeypatch):
+    # One IP per second, twice as many as the limit allows in a single query
+    timed_rows = [(second, [{'field': 'httpRequest.clientIp', 'value': '10.0.0.%d' % second}]) for second in range(8)]
+    monkeypatch.setattr(index, 'log_wrapper', LogWrapper(FakeLogsClient(timed_rows, running_polls = 0)))
+    monkeypatch.setattr(index, 'checkpoint_store', FixedWindows([(0, 8)]))
+    monkeypatch.setattr(index, 'query_limit', 4)
+
+    ips, processed = index.query_new_logs(time.monotonic() + 5)
+    assert sorted(ips) == ['10.0.0.%d' % second for second in range(8)]
+    assert processed == (0, 8)
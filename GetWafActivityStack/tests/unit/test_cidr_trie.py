@@ -0,0 +1,18 @@
+import ipaddress, os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lambda', 'code'))
+
+from cidr_trie import PrefixTrie
+
+def test_wider_prefix_prunes_covered_entries():
+    trie = PrefixTrie(['10.0.0.1/32', '10.0.0.128/25', '10.0.1.0/24', '2001:db8::/64'])
+    assert trie.add('10.0.0.0/24')
+    assert sorted(map(str, trie)) == ['10.0.0.0/24', '10.0.1.0/24', '2001:db8::/64']
+    assert not trie.add('10.0.0.7/32')
+    assert trie.covers('10.0.0.200') and not trie.covers('10.0.2.1')
+
+def test_contained_prefix_is_not_added():
+    trie = PrefixTrie([ipaddress.ip_network('192.0.2.0/24')])
+    assert not trie.add('192.0.2.0/24')
+    assert not trie.add('192.0.2.64/26')
+    assert len(trie) == 1
@@ -0,0 +1,31 @@
+import os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lambda', 'code'))
+
+import dynamodb_batch
+
+class ThrottledTable:
+    """Leaves the whole request unprocessed for the first `throttled` calls."""
+    def __init__(self, throttled):
+        self.throttled = throttled
+        self.calls = 0
+
+    def batch_write_item(self, RequestItems):
+        self.calls += 1
+        if self.calls <= self.throttled:
+            return {'UnprocessedItems': RequestItems}
+        return {'UnprocessedItems': {}}
+
+def test_unprocessed_items_are_resent_with_backoff(monkeypatch):
+    delays = []
+    monkeypatch.setattr(dynamodb_batch.time, 'sleep', delays.append)
+    table = ThrottledTable(throttled = 2)
+    responses = dynamodb_batch.batch_call(table.batch_write_item, {'table': [{}]}, 'UnprocessedItems')
+    assert table.calls == len(responses) == 3
+    assert len(delays) == 2 and all(0 <= delay <= 2.0 for delay in delays)
+
+def test_gives_up_after_max_attempts(monkeypatch):
+    monkeypatch.setattr(dynamodb_batch.time, 'sleep', lambda delay: None)
+    table = ThrottledTable(throttled = 100)
+    dynamodb_batch.batch_call(table.batch_write_item, {'table': [{}]}, 'UnprocessedItems', max_attempts = 4)
+    assert table.calls == 4
@@ -0,0 +1,38 @@
+import os, sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', '..', 'lambda', 'code'))
+sys.path.insert(0, os.path.join(HERE, '..', '..', 'benchmarks'))
+
+import waf_wrapper
+from fakes import FakeWAFClient
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def test_snapshot_survives_the_schedule_interval(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(waf_wrapper.time, 'monotonic', clock)
+    client = FakeWAFClient(['10.0.0.0/24'])
+    wrapper = waf_wrapper.WAFWrapper(client)
+
+    wrapper.update_ip_set_batch(['10.0.0.0/24'], 'id', 'name')
+    # Next scheduled run, 10 minutes later, with only covered prefixes
+    clock.now += 600
+    summary = wrapper.update_ip_set_batch(['10.0.0.0/24'], 'id', 'name')
+    assert summary['added'] == [] and client.calls['get_ip_set'] == 1
+
+def test_stale_lock_token_refreshes_and_merges(monkeypatch):
+    client = FakeWAFClient(['10.0.0.0/24'])
+    wrapper = waf_wrapper.WAFWrapper(client)
+    wrapper.get_snapshot('id', 'name')
+    # Someone else changes the set, the cached lock token is now stale
+    client.update_ip_set('name', 'CLOUDFRONT', 'id', ['10.0.0.0/24', '192.0.2.0/24'], client.lock_token)
+
+    summary = wrapper.update_ip_set_batch(['198.51.100.0/24'], 'id', 'name')
+    assert summary['added'] == ['198.51.100.0/24']
+    assert client.addresses == ['10.0.0.0/24', '192.0.2.0/24', '198.51.100.0/24']
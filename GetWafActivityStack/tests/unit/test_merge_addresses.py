@@ -0,0 +1,17 @@
+import os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lambda', 'code'))
+
+from waf_wrapper import WAFWrapper
+
+def test_existing_entries_are_kept_below_the_limit():
+    # Adjacent operator entries would collapse into 10.0.0.0/23, they must stay as written
+    addresses = ['10.0.0.0/24', '10.0.1.0/24', '192.0.2.7/32']
+    merged, added = WAFWrapper(None).merge_addresses(addresses, ['10.0.0.0/24', '198.51.100.0/24'], max_addresses = 10)
+    assert added == ['198.51.100.0/24']
+    assert merged == addresses + ['198.51.100.0/24']
+
+def test_set_is_collapsed_over_the_limit():
+    merged, added = WAFWrapper(None).merge_addresses(['10.0.0.0/24', '10.0.1.0/24'], ['10.0.2.0/24'], max_addresses = 2)
+    assert added == ['10.0.2.0/24']
+    assert len(merged) <= 2
@@ -0,0 +1,41 @@
+import os, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lambda', 'code'))
+
+from log_wrapper import LogWrapper
+
+def record(ip, ptr):
+    return [{'field': 'httpRequest.clientIp', 'value': ip}, {'field': '@ptr', 'value': ptr}]
+
+class ScriptedLogsClient:
+    """Replays a fixed list of get_query_results responses, repeating the last one."""
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.stopped = False
+
+    def get_query_results(self, queryId):
+        return self.responses.pop(0) if len(self.responses) > 1 else self.responses[0]
+
+    def stop_query(self, queryId):
+        self.stopped = True
+        return {'success': True}
+
+def test_partial_results_are_not_consumed():
+    # The running snapshot is re-sorted before completion, reading it as append-only would drop 3.3.3.3
+    client = ScriptedLogsClient([
+        {'status': 'Running', 'results': [record('1.1.1.1', 'a'), record('2.2.2.2', 'b')]},
+        {'status': 'Complete', 'results': [record('3.3.3.3', 'c'), record('1.1.1.1', 'a'), record('2.2.2.2', 'b')]}
+    ])
+    log_wrapper = LogWrapper(client)
+    records = list(log_wrapper.poll_query('query', time.monotonic() + 5, initial_delay = 0.01))
+    assert [fields[0]['value'] for fields in records] == ['3.3.3.3', '1.1.1.1', '2.2.2.2']
+
+def test_deadline_uses_final_snapshot_deduplicated():
+    client = ScriptedLogsClient([
+        {'status': 'Running', 'results': [record('1.1.1.1', 'a')]},
+        {'status': 'Cancelled', 'results': [record('2.2.2.2', 'b'), record('1.1.1.1', 'a'), record('2.2.2.2', 'b')]}
+    ])
+    log_wrapper = LogWrapper(client)
+    records = list(log_wrapper.poll_query('query', time.monotonic() - 1))
+    assert client.stopped and log_wrapper.stopped_queries == 1
+    assert [fields[0]['value'] for fields in records] == ['2.2.2.2', '1.1.1.1']
@@ -0,0 +1,36 @@
+import os, subprocess, sys
+
+import pytest
+
+CODE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lambda', 'code')
+sys.path.insert(0, CODE_DIR)
+
+import ip_clustering
+from log_wrapper import IPCount
+from waf_wrapper import WAFWrapper
+
+IPS = (
+    ['1.2.3.4'] * 5                                   # one IP repeated, a single distinct address
+    + ['5.6.7.%d' % host for host in (1, 2, 3, 4, 4)]  # four distinct addresses, one repeated
+    + ['9.9.9.1', '9.9.9.2', '9.9.9.2', '9.9.9.3']     # three distinct addresses
+)
+
+def test_same_cidr_paths_agree_on_duplicate_ips():
+    waf_wrapper = WAFWrapper(None)
+    assert sorted(waf_wrapper.get_same_cidr_ips(IPS)) == sorted(waf_wrapper.count_same_cidr_ips(IPS)) == ['5.6.7.0/24']
+
+def test_same_cidr_paths_agree_on_rows():
+    waf_wrapper = WAFWrapper(None)
+    rows = [IPCount(ip, 3, ip.rsplit('.', 1)[0]) for ip in IPS]
+    assert sorted(waf_wrapper.get_same_cidr_ips(rows)) == sorted(waf_wrapper.count_same_cidr_ips(rows)) == ['5.6.7.0/24']
+
+@pytest.mark.parametrize('ips', [['1.2.3.4.5', '6.7.8', '9.9.9.9'], ['1.2.3.256'], ['1.2.3.4', '']])
+def test_pack_ipv4_rejects_malformed_entries(ips):
+    with pytest.raises(ValueError):
+        ip_clustering.pack_ipv4(ips)
+
+def test_importing_waf_wrapper_leaves_numpy_unloaded():
+    # A fresh interpreter, numpy is only imported once same-CIDR detection runs
+    probe = "import sys; sys.path.insert(0, sys.argv[1]); import waf_wrapper; print('numpy' in sys.modules, 'ip_clustering' in sys.modules)"
+    output = subprocess.run([sys.executable, '-c', probe, CODE_DIR], capture_output = True, text = True, check = True).stdout
+    assert output.split() == ['False', 'False']
@@ -0,0 +1,20 @@
+import os, sys, uuid
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', '..', 'lambda', 'code'))
+sys.path.insert(0, os.path.join(HERE, '..', '..', 'benchmarks'))
+
+from fakes import FakeSecretsClient
+from secret_wrapper import SecretsWrapper
+
+def test_expired_entry_is_revalidated_inline():
+    client = FakeSecretsClient({'virustotalkey': 'old'})
+    secret_wrapper = SecretsWrapper(client, ttl = 0)
+    assert secret_wrapper.get_secrets('vt')['virustotalkey'] == 'old'
+    assert secret_wrapper.get_secrets('vt')['virustotalkey'] == 'old'
+    assert client.calls == {'get_secret_value': 1, 'describe_secret': 1}
+
+    # A rotation moves AWSCURRENT to a new version, the next call returns the new value
+    client.secret, client.version_id = {'virustotalkey': 'new'}, str(uuid.uuid4())
+    assert secret_wrapper.get_secrets('vt')['virustotalkey'] == 'new'
+    assert client.calls == {'get_secret_value': 2, 'describe_secret': 2}
@@ -0,0 +1,37 @@
+import os, sys, threading, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lambda', 'code'))
+
+from virustotal_wrapper import Verdict, VirusTotalWrapper
+
+class SlowVirusTotal(VirusTotalWrapper):
+    def __init__(self, delay):
+        super().__init__(http = object(), max_workers = 1)
+        self.delay = delay
+        self.looked_up = []
+        self._lock = threading.Lock()
+
+    def get_ip_report(self, ip, api_key):
+        time.sleep(self.delay)
+        with self._lock:
+            self.looked_up.append(ip)
+        return Verdict(ip, 0, 0, 200, None)
+
+IPS = ['10.0.0.%d' % host for host in range(20)]
+
+def test_early_stop_cancels_queued_lookups():
+    vt_wrapper = SlowVirusTotal(delay = 0.05)
+    started = time.monotonic()
+    verdicts = vt_wrapper.lookup_ips(IPS, 'key')
+    next(verdicts)
+    verdicts.close()
+    assert time.monotonic() - started < 0.5
+    time.sleep(0.1)
+    assert len(vt_wrapper.looked_up) < len(IPS)
+
+def test_deadline_reports_the_remaining_ips():
+    vt_wrapper = SlowVirusTotal(delay = 0.05)
+    verdicts = list(vt_wrapper.lookup_ips(IPS, 'key', deadline = time.monotonic() + 0.2))
+    assert sorted(verdict.ip for verdict in verdicts) == sorted(IPS)
+    skipped = [verdict for verdict in verdicts if verdict.error is not None]
+    assert skipped and len(vt_wrapper.looked_up) < len(IPS)
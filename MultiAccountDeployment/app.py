@@ -2,6 +2,7 @@
 import os
 import aws_cdk as cdk
 from get_credential_report.get_credential_report_stack import GetCredentialReportStack
+from get_credential_report.org_credential_report_stack import OrgCredentialReportStack
 from aws_cdk import (Tags)
 
 
@@ -25,6 +26,18 @@ ProdStack = GetCredentialReportStack(app, "ProdStack",
     env=cdk.Environment(account=os.environ["CDK_DEFAULT_ACCOUNT"], region=os.environ["CDK_DEFAULT_REGION"])
     )
 
+# Optional organization wide collector, deployed to the management account with -c org_member_role=<role name>.
+# It disables the weekly rules of the stacks above. Add -c org_member_targets=r-xxxx,ou-xxxx (root or OU ids) to
+# also create the member role, through a service managed StackSet, in every account below those targets
+if app.node.try_get_context("org_member_role"):
+    OrgStack = OrgCredentialReportStack(app, "OrgStack",
+        topic = ProdStack.topic,
+        stack_name = "OrgCredentialReportStack",
+        description="This stack will collect credential reports across the organization and send to slack channel",
+        env=cdk.Environment(account=os.environ["CDK_DEFAULT_ACCOUNT"], region=os.environ["CDK_DEFAULT_REGION"])
+        )
+    Tags.of(OrgStack).add("Environment","Prod")
+
 Tags.of(DevStack).add("Environment","Dev")
 Tags.of(TestStack).add("Environment","Test")
 Tags.of(ProdStack).add("Environment","Prod")
@@ -6,6 +6,7 @@ from aws_cdk import (
     aws_sns as sns,
     aws_sns_subscriptions as sub,
     aws_iam as iam,
+    aws_s3 as s3,
     aws_events as events,
     aws_lambda as lambda_,
     aws_events_targets as targets
@@ -20,6 +21,9 @@ class GetCredentialReportStack(Stack):
 
         # Get environment variables
         slack_url = self.node.try_get_context("slack_url")
+        snapshots = self.node.try_get_context("snapshots")
+        # When the organization stack is deployed it sends the weekly reports for every account
+        org_member_role = self.node.try_get_context("org_member_role")
 
         # Permissions for lambda functions
         inline_policy = iam.PolicyStatement(
@@ -27,7 +31,8 @@ class GetCredentialReportStack(Stack):
             resources=['*'], 
             actions=[
             'iam:GenerateCredentialReport', 
-            'iam:GetCredentialReport'
+            'iam:GetCredentialReport',
+            'iam:GetAccountPasswordPolicy'
             ])
         
         lambda_role = iam.Role(self, "LambdaPermissions",
@@ -61,9 +66,18 @@ class GetCredentialReportStack(Stack):
             display_name="SlackNotificationTopic",
             topic_name="SlackNotificationTopic"
         )
+        self.topic = topic
 
         topic.add_subscription(sub.LambdaSubscription(lambdaSNS))
 
+        # Shared credential report helpers from credential_report_core
+        core_layer = lambda_.LayerVersion(
+            self, "CredentialReportCoreLayer",
+            code=lambda_.Code.from_asset("../credential_report_core", exclude=["benchmarks", "tests"]),
+            compatible_runtimes=[lambda_.Runtime.PYTHON_3_9],
+            description="Credential report helpers"
+        )
+
         # Producer lambda function
         lambdaFn = lambda_.Function(
             self, "GetCredentialReportFunction",
@@ -76,14 +90,16 @@ class GetCredentialReportStack(Stack):
                         'sns_topic': (topic.topic_arn),
                         'environment': os.environ["CDK_DEFAULT_ACCOUNT"]
                         },
+            layers = [core_layer],
             role = (lambda_role)
             )
 
-        # Run every Monday at 12PM UTC
+        # Run every Monday at 12PM UTC, disabled in favour of the organization schedule when org_member_role is set
         # See https://docs.aws.amazon.com/lambda/latest/dg/tutorial-scheduled-events-schedule-expressions.html
         rule = events.Rule(
             self, "Rule",
             rule_name='Get-Credential-Report-Scheduled-Rule',
+            enabled=not org_member_role,
             schedule=events.Schedule.cron(
                 minute='0',
                 hour='12',
@@ -93,6 +109,17 @@ class GetCredentialReportStack(Stack):
         )
         rule.add_target(targets.LambdaFunction(lambdaFn))
 
+        # Optional weekly report snapshots, notifications then only carry the changes since the last run
+        if snapshots:
+            bucket = s3.Bucket(
+                self, "SnapshotBucket",
+                block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
+                encryption=s3.BucketEncryption.S3_MANAGED,
+                enforce_ssl=True
+            )
+            bucket.grant_read_write(lambdaFn)
+            lambdaFn.add_environment('snapshot_bucket', bucket.bucket_name)
+
         # Adding tag Name to resources, otherwise it will inherit stack Name tag
         Tags.of(lambdaFn).add("Name", "Get-Credentials-Report-Function")
         Tags.of(lambdaSNS).add("Name", "SNS-To-Slack-Function")
@@ -0,0 +1,103 @@
+import boto3
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import os, json
+from time import time
+import logging
+from credential_report import CredentialAudit, ExpiryDigest, read_report, iter_credential_report, get_credential_report, get_max_password_age
+
+logger = logging.getLogger()
+logging.basicConfig(
+    format="[%(asctime)s] %(levelname)s [%(module)s.%(funcName)s:%(lineno)d] %(message)s", datefmt="%H:%M:%S"
+)
+logger.setLevel(os.getenv('log_level', logging.INFO))
+
+# seconds an existing credential report is reused for, IAM expires reports after 4 hours
+report_max_age = int(os.getenv('report_max_age', 3600))
+# expired passwords older than this many days are listed in their own section
+long_expired_days = int(os.getenv('long_expired_days', 90))
+# upper bound in characters for one notification, longer digests are split
+digest_max_size = int(os.getenv('digest_max_size', 4000))
+# concurrent member accounts, each worker waits on IAM most of the time
+org_workers = int(os.getenv('org_workers', 16))
+# JSON object overriding the audit rule thresholds, e.g. {"password_unused": 180}
+credential_rules = json.loads(os.getenv('credential_rules') or '{}')
+
+client_sns = boto3.client('sns')
+client_org = boto3.client('organizations')
+client_sts = boto3.client('sts')
+sns_topic = os.environ['sns_topic']
+# Role assumed in every member account, it needs iam:GenerateCredentialReport,
+# iam:GetCredentialReport and iam:GetAccountPasswordPolicy
+member_role = os.environ['member_role']
+
+def list_active_accounts(client_org):
+    accounts = []
+    for page in client_org.get_paginator('list_accounts').paginate():
+        accounts.extend(account['Id'] for account in page['Accounts'] if account['Status'] == 'ACTIVE')
+    return accounts
+
+def member_iam_client(account_id):
+    credentials = client_sts.assume_role(
+        RoleArn = "arn:aws:iam::{}:role/{}".format(account_id, member_role),
+        RoleSessionName = 'OrgCredentialReport'
+    )['Credentials']
+    # Sessions are not thread safe, every worker builds its own
+    session = boto3.session.Session(
+        aws_access_key_id = credentials['AccessKeyId'],
+        aws_secret_access_key = credentials['SecretAccessKey'],
+        aws_session_token = credentials['SessionToken']
+    )
+    return session.client('iam')
+
+def collect_account(account_id, deadline):
+    iam_client = member_iam_client(account_id)
+    max_age = get_max_password_age(iam_client)
+    report = read_report(get_credential_report(iam_client, deadline, report_max_age))
+    rows = [row for row in iter_credential_report(report, max_age) if row.password_expires is not None]
+    return rows, report
+
+def collect_organization(accounts, deadline):
+    # Returns {account_id: ([CredentialReportRow], ReportColumns)} and {account_id: error} for the accounts that could not be collected
+    dataset, failed = {}, {}
+    with ThreadPoolExecutor(max_workers = org_workers) as executor:
+        futures = {executor.submit(collect_account, account_id, deadline): account_id for account_id in accounts}
+        for future in as_completed(futures):
+            account_id = futures[future]
+            try:
+                dataset[account_id] = future.result()
+            except Exception as e:
+                # One broken account (missing role, malformed report, ...) must not lose the others
+                logger.exception("Failed to collect credential report for account {}".format(account_id))
+                failed[account_id] = e.response['Error']['Code'] if isinstance(e, ClientError) else type(e).__name__
+    return dataset, failed
+
+def handler(event, context):
+    # Leave a few seconds of the invocation for the notifications
+    deadline = time() + context.get_remaining_time_in_millis() / 1000 - 5
+    accounts = list_active_accounts(client_org)
+    dataset, failed = collect_organization(accounts, deadline)
+    logger.info("Collected credential reports for {} of {} accounts".format(len(dataset), len(accounts)))
+
+    digest = ExpiryDigest(long_expired_days, digest_max_size)
+    audit = CredentialAudit(credential_rules, digest_max_size)
+    for account_id, (rows, report) in dataset.items():
+        for row in rows:
+            digest.add("{}/{}".format(account_id, row.user), row.password_expires)
+        audit.evaluate(report, prefix = "{}/".format(account_id))
+
+    header = "Organization: {} accounts".format(len(dataset))
+    if failed:
+        header += ", not collected: {}".format(", ".join("{} ({})".format(account_id, failed[account_id]) for account_id in sorted(failed)))
+    for message in digest.messages(header):
+        client_sns.publish(
+            TargetArn = sns_topic,
+            Message = message,
+            Subject = '--- PASSWORD EXPIRATION REPORT ---'
+        )
+    for message in audit.messages("Organization credential audit"):
+        client_sns.publish(
+            TargetArn = sns_topic,
+            Message = message,
+            Subject = '--- CREDENTIAL AUDIT REPORT ---'
+        )
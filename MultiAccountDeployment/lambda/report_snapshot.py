@@ -0,0 +1,156 @@
+from array import array
+import datetime
+import os
+import struct
+import zlib
+from credential_report import EPOCH, MISSING
+
+MAGIC = b'CRS1'
+# magic, snapshot day, user count
+HEADER = struct.Struct('<4sIi')
+# Day columns are stored as days since the epoch, MISSING when the report has N/A or no_information
+DAY_COLUMNS = ('password_last_changed', 'password_last_used', 'access_key_1_last_rotated', 'access_key_2_last_rotated')
+FLAG_COLUMNS = ('password_enabled', 'mfa_active', 'access_key_1_active', 'access_key_2_active')
+
+def from_epoch_day(day):
+    return EPOCH + datetime.timedelta(day) if day != MISSING else None
+
+class ReportSnapshot:
+    """Column oriented copy of a credential report, one array per column indexed by user position."""
+    def __init__(self, day, users, days, flags):
+        self.day = day
+        self.users = users
+        self.days = days
+        self.flags = flags
+        self._index = None
+
+    @classmethod
+    def from_report(cls, report, day = None):
+        # report is the ReportColumns the handler already read, so the CSV is not parsed again
+        flags = array('B', [0] * len(report.users))
+        for bit, column in enumerate(FLAG_COLUMNS):
+            for position, value in enumerate(report.flags[column]):
+                if value:
+                    flags[position] |= 1 << bit
+        days = {column: array('i', report.days[column]) for column in DAY_COLUMNS}
+        return cls(((day or datetime.date.today()) - EPOCH).days, list(report.users), days, flags)
+
+    def to_bytes(self):
+        blocks = [zlib.compress('\n'.join(self.users).encode('utf-8'))]
+        blocks.extend(zlib.compress(self.days[column].tobytes()) for column in DAY_COLUMNS)
+        blocks.append(zlib.compress(self.flags.tobytes()))
+        body = b''.join(struct.pack('<I', len(block)) + block for block in blocks)
+        return HEADER.pack(MAGIC, self.day, len(self.users)) + body
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, day, count = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("Not a credential report snapshot")
+        offset, blocks = HEADER.size, []
+        while offset < len(data):
+            (length,) = struct.unpack_from('<I', data, offset)
+            blocks.append(zlib.decompress(data[offset + 4:offset + 4 + length]))
+            offset += 4 + length
+        users = blocks[0].decode('utf-8').split('\n') if count else []
+        days = {}
+        for column, block in zip(DAY_COLUMNS, blocks[1:]):
+            days[column] = array('i')
+            days[column].frombytes(block)
+        flags = array('B')
+        flags.frombytes(blocks[-1])
+        return cls(day, users, days, flags)
+
+    def index(self, user):
+        if self._index is None:
+            self._index = {user: position for position, user in enumerate(self.users)}
+        return self._index.get(user)
+
+    def flag(self, position, column):
+        return bool(self.flags[position] >> FLAG_COLUMNS.index(column) & 1)
+
+class SnapshotDiff:
+    def __init__(self, since):
+        self.since = since
+        self.new_users = []
+        self.removed_users = []
+        self.password_changed = []
+        self.rotated_keys = []
+        self.new_expiries = []
+
+    def __bool__(self):
+        return any((self.new_users, self.removed_users, self.password_changed, self.rotated_keys, self.new_expiries))
+
+    def lines(self):
+        sections = (
+            ("New users", self.new_users),
+            ("Removed users", self.removed_users),
+            ("Password changed", self.password_changed),
+            ("Access keys rotated", ["{} ({})".format(user, key) for user, key in self.rotated_keys]),
+            ("ATTENTION! Passwords expired", ["{} on {}".format(user, day) for user, day in self.new_expiries])
+        )
+        for title, entries in sections:
+            for entry in entries:
+                yield "{} ({}):".format(title, len(entries)), entry
+
+def diff_snapshots(previous, current, max_age = None):
+    """Compares two snapshots, new_expiries holds passwords whose expiry day falls after previous.day up to current.day."""
+    diff = SnapshotDiff(from_epoch_day(previous.day))
+    for position, user in enumerate(current.users):
+        last_changed = current.days['password_last_changed'][position]
+        if max_age and current.flag(position, 'password_enabled') and last_changed != MISSING:
+            if previous.day < last_changed + max_age <= current.day:
+                diff.new_expiries.append((user, from_epoch_day(last_changed + max_age)))
+
+        before = previous.index(user)
+        if before is None:
+            diff.new_users.append(user)
+            continue
+        if last_changed != previous.days['password_last_changed'][before] and last_changed != MISSING:
+            diff.password_changed.append(user)
+        for key, column in (('key 1', 'access_key_1_last_rotated'), ('key 2', 'access_key_2_last_rotated')):
+            if current.days[column][position] != previous.days[column][before] and current.days[column][position] != MISSING:
+                diff.rotated_keys.append((user, key))
+
+    diff.removed_users = [user for user in previous.users if current.index(user) is None]
+    return diff
+
+class S3SnapshotStore:
+    def __init__(self, s3_client, bucket, prefix = 'credential-reports/'):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def load(self, account):
+        try:
+            response = self.s3_client.get_object(Bucket = self.bucket, Key = "{}{}/latest.crs".format(self.prefix, account))
+        except self.s3_client.exceptions.NoSuchKey:
+            return None
+        return ReportSnapshot.from_bytes(response['Body'].read())
+
+    def save(self, account, snapshot):
+        # latest.crs drives the next diff, the dated copy keeps the history queryable
+        data = snapshot.to_bytes()
+        for name in ('latest', from_epoch_day(snapshot.day).isoformat()):
+            self.s3_client.put_object(Bucket = self.bucket, Key = "{}{}/{}.crs".format(self.prefix, account, name), Body = data)
+
+class FileSnapshotStore:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def load(self, account):
+        try:
+            with open(os.path.join(self.directory, account, 'latest.crs'), 'rb') as fp:
+                return ReportSnapshot.from_bytes(fp.read())
+        except FileNotFoundError:
+            return None
+
+    def save(self, account, snapshot):
+        directory = os.path.join(self.directory, account)
+        os.makedirs(directory, exist_ok = True)
+        data = snapshot.to_bytes()
+        for name in ('latest', from_epoch_day(snapshot.day).isoformat()):
+            tmp_path = os.path.join(directory, name + '.crs.tmp')
+            with open(tmp_path, 'wb') as fp:
+                fp.write(data)
+            os.replace(tmp_path, os.path.join(directory, name + '.crs'))
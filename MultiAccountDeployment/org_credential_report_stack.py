@@ -0,0 +1,153 @@
+from aws_cdk import (
+    Duration,
+    Stack,
+    Tags,
+    aws_iam as iam,
+    aws_cloudformation as cloudformation,
+    aws_events as events,
+    aws_lambda as lambda_,
+    aws_events_targets as targets
+
+)
+from constructs import Construct
+
+class OrgCredentialReportStack(Stack):
+
+    def __init__(self, scope: Construct, construct_id: str, topic, **kwargs) -> None:
+        super().__init__(scope, construct_id, **kwargs)
+
+        # Get environment variables
+        member_role = self.node.try_get_context("org_member_role")
+        org_workers = self.node.try_get_context("org_workers") or 16
+        # Organizational unit (or root) ids to provision member_role in, leave unset when the role already exists
+        member_targets = self.node.try_get_context("org_member_targets")
+        if isinstance(member_targets, str):
+            # -c on the command line passes a comma separated string
+            member_targets = [target.strip() for target in member_targets.split(',') if target.strip()]
+
+        # Permissions for lambda function, it runs in the management account and assumes member_role everywhere
+        inline_policy = iam.PolicyStatement(
+            effect=iam.Effect.ALLOW, 
+            resources=['*'], 
+            actions=[
+            'organizations:ListAccounts'
+            ])
+
+        assume_policy = iam.PolicyStatement(
+            effect=iam.Effect.ALLOW, 
+            resources=['arn:aws:iam::*:role/{}'.format(member_role)], 
+            actions=[
+            'sts:AssumeRole'
+            ])
+
+        lambda_role = iam.Role(self, "LambdaPermissions",
+            assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+            role_name="LambdaRoleForOrgCredentialReport",
+            description="Lambda Role For Organization wide Credential Report"
+        )
+
+        lambda_role.add_managed_policy(iam.ManagedPolicy.from_aws_managed_policy_name("service-role/AWSLambdaBasicExecutionRole"))
+        lambda_role.add_to_policy(inline_policy)
+        lambda_role.add_to_policy(assume_policy)
+        topic.grant_publish(lambda_role)
+
+        member_actions = [
+            'iam:GenerateCredentialReport',
+            'iam:GetCredentialReport',
+            'iam:GetAccountPasswordPolicy'
+            ]
+
+        if member_targets:
+            # Service managed StackSets skip the management account, its role is created here
+            management_role = iam.Role(self, "ManagementMemberRole",
+                assumed_by=iam.ArnPrincipal(lambda_role.role_arn),
+                role_name=member_role,
+                description="Credential report access for the organization collector"
+            )
+            management_role.add_to_policy(iam.PolicyStatement(effect=iam.Effect.ALLOW, resources=['*'], actions=member_actions))
+
+            # The same role in every member account, deployed automatically to accounts joining the targets
+            member_template = {
+                'Resources': {
+                    'MemberRole': {
+                        'Type': 'AWS::IAM::Role',
+                        'Properties': {
+                            'RoleName': member_role,
+                            'Description': 'Credential report access for the organization collector',
+                            'AssumeRolePolicyDocument': {
+                                'Version': '2012-10-17',
+                                'Statement': [{'Effect': 'Allow', 'Principal': {'AWS': lambda_role.role_arn}, 'Action': 'sts:AssumeRole'}]
+                            },
+                            'Policies': [{
+                                'PolicyName': 'CredentialReport',
+                                'PolicyDocument': {
+                                    'Version': '2012-10-17',
+                                    'Statement': [{'Effect': 'Allow', 'Action': member_actions, 'Resource': '*'}]
+                                }
+                            }]
+                        }
+                    }
+                }
+            }
+            cloudformation.CfnStackSet(
+                self, "MemberRoleStackSet",
+                stack_set_name="OrgCredentialReportMemberRole",
+                permission_model="SERVICE_MANAGED",
+                auto_deployment=cloudformation.CfnStackSet.AutoDeploymentProperty(
+                    enabled=True,
+                    retain_stacks_on_account_removal=False
+                ),
+                capabilities=['CAPABILITY_NAMED_IAM'],
+                operation_preferences=cloudformation.CfnStackSet.OperationPreferencesProperty(
+                    max_concurrent_percentage=100,
+                    failure_tolerance_percentage=10
+                ),
+                # IAM is global, one region is enough
+                stack_instances_group=[cloudformation.CfnStackSet.StackInstancesProperty(
+                    deployment_targets=cloudformation.CfnStackSet.DeploymentTargetsProperty(organizational_unit_ids=member_targets),
+                    regions=[self.region]
+                )],
+                template_body=self.to_json_string(member_template)
+            )
+
+        # Same helper layer as the per account function
+        core_layer = lambda_.LayerVersion(
+            self, "CredentialReportCoreLayer",
+            code=lambda_.Code.from_asset("../credential_report_core", exclude=["benchmarks", "tests"]),
+            compatible_runtimes=[lambda_.Runtime.PYTHON_3_9],
+            description="Credential report helpers"
+        )
+
+        # Collector lambda function
+        lambdaFn = lambda_.Function(
+            self, "OrgCredentialReportFunction",
+            function_name = "OrgCredentialReport",
+            code=lambda_.Code.from_asset("lambda"),
+            handler="org_lambda.handler",
+            timeout=Duration.seconds(900),
+            memory_size=512,
+            runtime=lambda_.Runtime.PYTHON_3_9,
+            environment= {
+                        'sns_topic': (topic.topic_arn),
+                        'member_role': (member_role),
+                        'org_workers': str(org_workers)
+                        },
+            layers = [core_layer],
+            role = (lambda_role)
+            )
+
+        # Run every Monday at 12PM UTC, the per account rules are disabled while org_member_role is set
+        rule = events.Rule(
+            self, "Rule",
+            rule_name='Org-Credential-Report-Scheduled-Rule',
+            schedule=events.Schedule.cron(
+                minute='0',
+                hour='12',
+                month='*',
+                week_day='MON',
+                year='*'),
+        )
+        rule.add_target(targets.LambdaFunction(lambdaFn))
+
+        # Adding tag Name to resources, otherwise it will inherit stack Name tag
+        Tags.of(lambdaFn).add("Name", "Org-Credentials-Report-Function")
@@ -0,0 +1,75 @@
+import datetime, os, sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', '..', 'lambda'))
+sys.path.insert(0, os.path.join(HERE, '..', '..', '..', 'credential_report_core', 'python'))
+
+for name, value in (('sns_topic', 'test'), ('environment', '000000000000'), ('AWS_DEFAULT_REGION', 'us-east-1')):
+    os.environ.setdefault(name, value)
+
+import lambda_handler
+from credential_report import EPOCH, ExpiryDigest, iter_credential_report, read_report
+from report_snapshot import FileSnapshotStore, ReportSnapshot, diff_snapshots
+
+HEADER = ("user,user_creation_time,password_enabled,password_last_used,password_last_changed,mfa_active,"
+          "access_key_1_active,access_key_1_last_rotated,access_key_1_last_used_date,"
+          "access_key_2_active,access_key_2_last_rotated,access_key_2_last_used_date\n")
+TODAY = datetime.date(2024, 6, 3)
+
+def stamp(days_ago, today = TODAY):
+    return 'N/A' if days_ago is None else (today - datetime.timedelta(days_ago)).isoformat() + 'T09:00:00+00:00'
+
+def report(*users, today = TODAY):
+    # users are (name, password_last_changed days ago, key 1 rotated days ago)
+    rows = [HEADER]
+    for user, changed, rotated in users:
+        rows.append(f"{user},{stamp(400, today)},{'false' if changed is None else 'true'},N/A,{stamp(changed, today)},true,"
+                    f"{'false' if rotated is None else 'true'},{stamp(rotated, today)},N/A,false,N/A,N/A\n")
+    return read_report(''.join(rows).encode('utf-8'))
+
+def snapshot(*users, day = TODAY, today = TODAY):
+    return ReportSnapshot.from_report(report(*users, today = today), day)
+
+def test_snapshot_round_trip():
+    original = snapshot(('alice', 10, 5), ('bob', None, None), ('carol', 89, 200))
+    restored = ReportSnapshot.from_bytes(original.to_bytes())
+    assert restored.day == original.day == (TODAY - EPOCH).days
+    assert restored.users == ['alice', 'bob', 'carol']
+    assert restored.days == original.days and restored.flags == original.flags
+    assert restored.flag(0, 'password_enabled') and not restored.flag(1, 'password_enabled')
+
+def test_empty_snapshot_round_trip():
+    restored = ReportSnapshot.from_bytes(snapshot().to_bytes())
+    assert restored.users == [] and len(restored.flags) == 0
+
+def test_diff_reports_changes_since_previous():
+    previous = snapshot(('alice', 10, 5), ('bob', 30, 30), ('dave', 1, None), day = TODAY - datetime.timedelta(7))
+    # bob changed his password and rotated his key, carol is new and dave left
+    current = snapshot(('alice', 10, 5), ('bob', 2, 1), ('carol', 0, None))
+    diff = diff_snapshots(previous, current, max_age = 90)
+    assert diff.new_users == ['carol'] and diff.removed_users == ['dave']
+    assert diff.password_changed == ['bob'] and diff.rotated_keys == [('bob', 'key 1')]
+    assert diff.new_expiries == []
+
+def test_diff_reports_passwords_expired_since_previous():
+    previous = snapshot(('alice', 85, None), ('bob', 95, None), day = TODAY - datetime.timedelta(7))
+    current = snapshot(('alice', 92, None), ('bob', 102, None))
+    # alice expired 2 days ago, bob had already expired before the previous run
+    diff = diff_snapshots(previous, current, max_age = 90)
+    assert diff.new_expiries == [('alice', TODAY - datetime.timedelta(2))]
+
+def test_unchanged_week_still_warns_about_upcoming_expiries(tmp_path, monkeypatch):
+    # Same passwords as last week, all expiring within 10 days, so the diff itself is empty
+    today = datetime.date.today()
+    users = [('user{}'.format(index), 80 + index % 5, None) for index in range(25)]
+    store = FileSnapshotStore(str(tmp_path))
+    store.save(lambda_handler.environment, snapshot(*users, day = today - datetime.timedelta(7), today = today))
+    monkeypatch.setattr(lambda_handler, 'snapshot_store', store)
+
+    current = report(*users, today = today)
+    digest = ExpiryDigest()
+    for row in iter_credential_report(current, 90):
+        digest.add(row.user, row.password_expires)
+    messages, _ = lambda_handler.report_messages(current, digest, 90)
+    text = "\n".join(messages)
+    assert "Passwords expiring (25):" in text
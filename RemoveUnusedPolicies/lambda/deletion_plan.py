@@ -0,0 +1,93 @@
+import json
+import os
+
+def plan_name(label, now):
+    """
+    Names a new plan, every plan gets its own name so a reviewed plan is never overwritten.
+
+    :param label: Tells plans apart by origin, e.g. 'manual' or 'nightly'.
+    :param now: The datetime the plan is built at, in UTC.
+    :return: The plan name, e.g. 'manual-20240101T120000Z.jsonl'.
+    """
+    return f"{label}-{now.strftime('%Y%m%dT%H%M%SZ')}.jsonl"
+
+class S3PlanStore:
+    """
+    Keeps deletion plans as JSON lines, one S3 object per plan under a common prefix.
+    """
+
+    def __init__(self, s3_client, bucket, prefix):
+        """
+        :param s3_client: A Boto3 S3 client.
+        :param bucket: The bucket holding the plans.
+        :param prefix: The key prefix of the plans.
+        """
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def location(self, name):
+        return f"s3://{self.bucket}/{self.prefix}{name}"
+
+    def save(self, name, entries):
+        """
+        Writes a plan.
+
+        :param name: The name of the plan.
+        :param entries: An iterable of plan entry dicts.
+        """
+        body = ''.join(json.dumps(entry, separators = (',', ':')) + '\n' for entry in entries)
+        self.s3_client.put_object(Bucket = self.bucket, Key = self.prefix + name, Body = body.encode('utf-8'))
+
+    def load(self, name):
+        """
+        Reads a plan one entry at a time.
+
+        :param name: The name of the plan.
+        :return: A generator of plan entry dicts.
+        """
+        response = self.s3_client.get_object(Bucket = self.bucket, Key = self.prefix + name)
+        for line in response['Body'].iter_lines():
+            if line:
+                yield json.loads(line)
+
+class FilePlanStore:
+    """
+    Keeps deletion plans as JSON lines, one local file per plan in a directory.
+    """
+
+    def __init__(self, directory):
+        """
+        :param directory: The directory holding the plans.
+        """
+        self.directory = directory
+
+    def location(self, name):
+        return os.path.join(self.directory, name)
+
+    def save(self, name, entries):
+        """
+        Writes a plan.
+
+        :param name: The name of the plan.
+        :param entries: An iterable of plan entry dicts.
+        """
+        os.makedirs(self.directory, exist_ok = True)
+        path = self.location(name)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as fp:
+            for entry in entries:
+                fp.write(json.dumps(entry, separators = (',', ':')) + '\n')
+        os.replace(tmp_path, path)
+
+    def load(self, name):
+        """
+        Reads a plan one entry at a time.
+
+        :param name: The name of the plan.
+        :return: A generator of plan entry dicts.
+        """
+        with open(self.location(name)) as fp:
+            for line in fp:
+                if line.strip():
+                    yield json.loads(line)
@@ -1,9 +1,15 @@
 import boto3
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
 import logging
 import os
+from time import sleep, time
+from deletion_plan import S3PlanStore, FilePlanStore, plan_name
+from policy_events import parse_policy_change
 
-# Initialize the AWS SDK clients
-iam = boto3.resource('iam')
+# Initialize the AWS SDK clients, adaptive retries absorb IAM throttling from the concurrent deletes
+iam_client = boto3.client('iam', config = Config(retries = {'mode': 'adaptive', 'max_attempts': 10}))
 client_sns = boto3.client('sns')
 
 # Configure logging
@@ -12,72 +18,302 @@ logging.basicConfig(
     format="[%(asctime)s] %(levelname)s [%(module)s.%(funcName)s:%(lineno)d] %(message)s", datefmt="%H:%M:%S"
 )
 logger.setLevel(os.getenv('log_level', logging.INFO))
+
+# Number of policies deleted concurrently
+max_workers = int(os.getenv('max_workers', 8))
+# 'delete' deletes right away. With 'plan' or 'apply' nothing is deleted unless an invocation names the mode,
+# {"mode": "plan"} writes a new deletion plan and {"mode": "apply", "plan": <name>} executes a reviewed one
+default_mode = os.getenv('mode', 'delete')
+# Plan entries deleted per batch in apply mode, the deadline is checked between batches
+batch_size = int(os.getenv('batch_size', 50))
+# Detach events only re-evaluate the policy they name instead of rescanning, a daily scan covers the rest
+per_policy_events = os.getenv('per_policy_events', 'false').lower() == 'true'
+
+def create_plan_store():
+    """
+    Creates the plan store from the plan_bucket or plan_dir environment variables.
+
+    :return: An S3PlanStore, a FilePlanStore, or None when neither is configured.
+    """
+    if os.getenv('plan_bucket'):
+        return S3PlanStore(boto3.client('s3'), os.environ['plan_bucket'], os.getenv('plan_prefix', 'remove-unused-policies/'))
+    if os.getenv('plan_dir'):
+        return FilePlanStore(os.environ['plan_dir'])
+    return None
   
 def list_policies(scope = 'All'):
     """
-    Lists the policies in the current account.
+    Lists the policies in the current account, one page at a time.
 
     :param scope: Limits the kinds of policies that are returned. For example,
                   'Local' specifies that only locally managed policies are returned.
-    :return: The list of policies, or None if an error occurs.
+    :return: A generator of policy dicts as returned by ListPolicies, including
+             AttachmentCount and PermissionsBoundaryUsageCount.
     """
-    try:
-        # Use the IAM resource to list the policies with the specified scope
-        policies = list(iam.policies.filter(
-                        Scope = scope,
-                        MaxItems = 120
-                        ))
-        
-        # Log the number of policies retrieved
-        logger.info("Got %s policies in scope '%s'.", len(policies), scope)
-
-        # Return the list of policies
-        return policies
-    
-    except Exception as e:
-        logger.exception(e)
-        return None
+    count = 0
+    paginator = iam_client.get_paginator('list_policies')
+    for page in paginator.paginate(Scope = scope, OnlyAttached = False):
+        for policy in page['Policies']:
+            count += 1
+            yield policy
 
-def delete_policy(policy):
+    # Log the number of policies retrieved
+    logger.info("Got %s policies in scope '%s'.", count, scope)
+
+def list_version_ids(policy_arn):
+    """
+    Lists the non-default versions of a policy, these have to go before the policy itself.
+
+    :param policy_arn: The ARN of the policy.
+    :return: The list of version IDs.
+    """
+    versions = iam_client.list_policy_versions(PolicyArn = policy_arn)['Versions']
+    return [version['VersionId'] for version in versions if not version['IsDefaultVersion']]
+
+def delete_policy(policy_arn):
     """
     Deletes the specified policy.
 
-    :param policy: The policy to delete.
+    :param policy_arn: The ARN of the policy to delete.
+    :return: True when the policy was deleted or no longer exists, False otherwise.
     """
     try:
         # Delete all versions of the policy except for the default version
-        for version in policy.versions.all():
-            if not version.is_default_version:
-                version.delete()
-                logger.info("Deleted policy version '%s'.", version.version_id)
+        for version_id in list_version_ids(policy_arn):
+            try:
+                iam_client.delete_policy_version(PolicyArn = policy_arn, VersionId = version_id)
+                logger.info("Deleted policy version '%s'.", version_id)
+            except iam_client.exceptions.NoSuchEntityException:
+                # Deleted concurrently, e.g. by an earlier apply of the same plan
+                pass
 
         # Delete the policy and log a success message
-        policy.delete()
-        logger.info("Policy '%s' deleted.", policy.arn)
-    
+        iam_client.delete_policy(PolicyArn = policy_arn)
+        logger.info("Policy '%s' deleted.", policy_arn)
+        return True
+
+    except iam_client.exceptions.NoSuchEntityException:
+        logger.info("Policy '%s' was already deleted.", policy_arn)
+        return True
+
     except Exception as e:
-        logger.error(f"Couldn't delete policy '%s': {e}", policy.arn)
+        logger.error(f"Couldn't delete policy '%s': {e}", policy_arn)
         logger.exception(e)
+        return False
+
+def is_unused(policy):
+    """
+    Checks the attachment counts ListPolicies already returned, no extra GetPolicy call is needed.
+
+    :param policy: A policy dict from list_policies.
+    :return: True when the policy is neither attached nor used as a permissions boundary.
+    """
+    return not policy['AttachmentCount'] and not policy.get('PermissionsBoundaryUsageCount')
 
-def check_and_delete_policies(policies):
+def check_and_delete_policies(policies, deadline = None):
     """
     Checks for attachments on each policy and deletes any policies with no attachments.
+    Deletions run concurrently while the policies are still being listed.
 
-    :param policies: The list of policies to check and delete.
+    :param policies: An iterable of policy dicts to check and delete.
+    :param deadline: Epoch seconds after which no new deletions are started, the
+                     remaining policies are picked up by the next invocation.
+    :return: The number of deleted policies.
     """
-    try:
+    def delete_unless_late(policy_arn):
+        # Deletions wait in the executor queue, the deadline may have passed by the time a worker picks one up
+        if deadline is not None and time() > deadline:
+            return None
+        return delete_policy(policy_arn)
+
+    deleted = skipped = 0
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        futures = []
         for policy in policies:
-            # Use the policy ARN to get the policy object
-            policy_obj = iam.Policy(policy.arn)
-            # Check if the policy has any attachments
-            if not policy_obj.attachment_count:
-                logger.info("Policy '%s' has no attachments and will be deleted.", policy.arn)
-                # If the policy has no attachments, delete it
-                delete_policy(policy_obj)
+            if not is_unused(policy):
+                logger.info("Policy '%s' has %d attachments and %d permissions boundary uses and will not be deleted.",
+                            policy['Arn'], policy['AttachmentCount'], policy.get('PermissionsBoundaryUsageCount', 0))
+                continue
+            if deadline is not None and time() > deadline:
+                skipped += 1
+                continue
+            logger.info("Policy '%s' has no attachments and will be deleted.", policy['Arn'])
+            futures.append(executor.submit(delete_unless_late, policy['Arn']))
+
+        total = len(futures) + skipped
+        for future in as_completed(futures):
+            result = future.result()
+            if result is None:
+                skipped += 1
             else:
-                logger.info("Policy '%s' has %d attachments and will not be deleted.", policy.arn, policy_obj.attachment_count)
-    except Exception as e:
-        logger.exception(e)
+                deleted += result
+
+    if skipped:
+        logger.warning("Deadline reached, %d unused policies are left for the next run.", skipped)
+    logger.info("Deleted %d of %d unused policies.", deleted, total)
+    return deleted
+
+def get_last_accessed(policy_arn, deadline):
+    """
+    Gets the service last accessed data of a policy.
+
+    :param policy_arn: The ARN of the policy.
+    :param deadline: Epoch seconds after which the report job is no longer waited for.
+    :return: A dict with the latest LastAuthenticated time and the services used,
+             or None when the job did not complete in time.
+    """
+    job_id = iam_client.generate_service_last_accessed_details(Arn = policy_arn)['JobId']
+    delay = 0.5
+    response = iam_client.get_service_last_accessed_details(JobId = job_id)
+    while response['JobStatus'] == 'IN_PROGRESS':
+        if time() + delay > deadline:
+            return None
+        sleep(delay)
+        delay = min(delay * 2, 5)
+        response = iam_client.get_service_last_accessed_details(JobId = job_id)
+    if response['JobStatus'] != 'COMPLETED':
+        return None
+
+    services = list(response['ServicesLastAccessed'])
+    while response.get('IsTruncated'):
+        response = iam_client.get_service_last_accessed_details(JobId = job_id, Marker = response['Marker'])
+        services.extend(response['ServicesLastAccessed'])
+
+    used = [service for service in services if service.get('LastAuthenticated')]
+    return {
+        'last_authenticated': max(service['LastAuthenticated'] for service in used).isoformat() if used else None,
+        'services': sorted(service['ServiceNamespace'] for service in used)
+    }
+
+def plan_entry(policy, deadline):
+    """
+    Builds the deletion plan entry of an unused policy.
+
+    :param policy: A policy dict from list_policies.
+    :param deadline: Epoch seconds after which last accessed data is no longer waited for.
+    :return: The plan entry dict.
+    """
+    entry = {
+        'arn': policy['Arn'],
+        'name': policy['PolicyName'],
+        'update_date': policy['UpdateDate'].isoformat(),
+        # For review only, apply lists the versions again before deleting
+        'versions': list_version_ids(policy['Arn']),
+        'last_authenticated': None,
+        'services': None
+    }
+    entry.update(get_last_accessed(policy['Arn'], deadline) or {})
+    return entry
+
+def build_plan(policies, deadline):
+    """
+    Builds the deletion plan for the policies that have no attachments, without deleting anything.
+
+    :param policies: An iterable of policy dicts to check.
+    :param deadline: Epoch seconds after which last accessed data is no longer waited for.
+    :return: The list of plan entries ordered by ARN, each with its index in the plan.
+    """
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        futures = [executor.submit(plan_entry, policy, deadline) for policy in policies if is_unused(policy)]
+        entries = sorted((future.result() for future in futures), key = lambda entry: entry['arn'])
+    for index, entry in enumerate(entries):
+        entry['index'] = index
+    logger.info("Planned the deletion of %d unused policies.", len(entries))
+    return entries
+
+def iter_batches(entries, start = 0):
+    """
+    Groups plan entries into batches of batch_size.
+
+    :param entries: An iterable of plan entry dicts.
+    :param start: The index of the first entry to include.
+    :return: A generator of lists of plan entries.
+    """
+    batch = []
+    for entry in entries:
+        if entry['index'] < start:
+            continue
+        batch.append(entry)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def apply_entry(entry):
+    """
+    Deletes the policy of a plan entry once IAM confirms it is still unused. The plan can be
+    days old, so the attachment counts and versions are read again instead of trusting it.
+
+    :param entry: A plan entry dict.
+    :return: True when the policy was deleted or no longer exists, False when the deletion
+             failed, None when the policy is in use again and was left alone.
+    """
+    counts = get_policy_counts(entry['arn'])
+    if counts is None:
+        logger.info("Policy '%s' was already deleted.", entry['arn'])
+        return True
+    if counts != (0, 0):
+        logger.warning("Policy '%s' now has %d attachments and %d permissions boundary uses, it is left alone.", entry['arn'], *counts)
+        return None
+    return delete_policy(entry['arn'])
+
+def apply_plan(entries, deadline, start = 0):
+    """
+    Deletes the policies of a stored plan in batches. Entries already deleted count as done,
+    so a plan can be applied again after a partial run. Policies attached since the plan was
+    built are skipped.
+
+    :param entries: An iterable of plan entry dicts.
+    :param deadline: Epoch seconds after which no new batch is started.
+    :param start: The index of the first entry to apply.
+    :return: The index to resume from, or None when the whole plan was applied.
+    """
+    deleted = failed = in_use = 0
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        for batch in iter_batches(entries, start):
+            if time() > deadline:
+                logger.warning("Deadline reached after %d deletions, resume the plan from index %d.", deleted, batch[0]['index'])
+                return batch[0]['index']
+            results = list(executor.map(apply_entry, batch))
+            deleted += results.count(True)
+            failed += results.count(False)
+            in_use += results.count(None)
+    logger.info("Applied the plan, %d policies deleted, %d in use again and %d failed.", deleted, in_use, failed)
+    return None
+
+def get_policy_counts(policy_arn):
+    """
+    Gets the current attachment and permissions boundary counts of a policy from IAM.
+
+    :param policy_arn: The ARN of the policy.
+    :return: The (attachments, boundaries) tuple, or None when the policy does not exist.
+    """
+    try:
+        policy = iam_client.get_policy(PolicyArn = policy_arn)['Policy']
+    except iam_client.exceptions.NoSuchEntityException:
+        return None
+    return policy['AttachmentCount'], policy.get('PermissionsBoundaryUsageCount', 0)
+
+def handle_policy_change(change):
+    """
+    Deletes the policy named by a detach event once its last attachment is gone. EventBridge
+    delivers events at least once and out of order, so the counts are always read from IAM.
+    Costs one GetPolicy call and at most a deletion whatever the number of policies.
+
+    :param change: The PolicyChange parsed from the CloudTrail event.
+    """
+    policy_arn = change.policy_arn
+    counts = get_policy_counts(policy_arn)
+    if counts is None:
+        return
+    logger.info("Policy '%s' after %s: %d attachments, %d permissions boundary uses.", policy_arn, change.event_name, *counts)
+    if counts != (0, 0):
+        return
+    if default_mode != 'delete':
+        logger.info("Policy '%s' has no attachments left, mode '%s' leaves it for the plan.", policy_arn, default_mode)
+    else:
+        delete_policy(policy_arn)
 
 """ Global variables """
 account_id = os.environ["AccountId"]
@@ -102,10 +338,57 @@ def handle_exception(e):
 
 def lambda_handler(event, context):
     try:
-        # List policies with no attachments
+        # Leave some of the invocation for the running deletions to finish
+        deadline = time() + context.get_remaining_time_in_millis() / 1000 - 10
+        if event.get('detail-type') == 'AWS API Call via CloudTrail':
+            if per_policy_events:
+                # Only the affected policy is re-evaluated, deletions still follow the mode
+                change = parse_policy_change(event)
+                if change is not None:
+                    handle_policy_change(change)
+            elif default_mode == 'delete':
+                # Without per policy handling an event rescans all policies
+                check_and_delete_policies(list_policies(scope = 'Local'), deadline)
+            else:
+                logger.info("Mode '%s' only plans or applies on an explicit invocation, event ignored.", default_mode)
+            return
+
+        # Plan and apply are review steps, they only run when the invocation names them,
+        # e.g. {"mode": "apply", "plan": "manual-20240101T120000Z.jsonl", "start": 500}
+        mode = event.get('mode', 'delete' if default_mode == 'delete' else None)
+        if mode is None:
+            logger.info("Mode '%s' needs the invocation to name the mode, nothing to do.", default_mode)
+            return
+        if mode not in ('delete', 'plan', 'apply'):
+            raise ValueError(f"Unknown mode '{mode}'")
+        plan_store = create_plan_store()
+        if mode in ('plan', 'apply') and plan_store is None:
+            raise ValueError(f"Mode '{mode}' needs plan_bucket or plan_dir to be set")
+
         policies = list_policies(scope = 'Local')
-        # Check for attachments and delete policies with
-        check_and_delete_policies(policies)
+
+        if mode == 'plan':
+            # Every plan gets its own name, so the plan under review is the one that gets applied
+            # The label keeps scheduled plans apart from manual ones, e.g. {"mode": "plan", "label": "nightly"}
+            name = plan_name(event.get('label', 'manual'), datetime.now(timezone.utc))
+            entries = build_plan(policies, deadline)
+            plan_store.save(name, entries)
+            client_sns.publish(
+                TargetArn = sns_topic,
+                Message = (f"Deletion plan for {len(entries)} unused policies in account: {account_id} written to {plan_store.location(name)}, "
+                           f"apply it with {{\"mode\": \"apply\", \"plan\": \"{name}\"}}"),
+                Subject = '--- UNUSED POLICIES PLAN ---'
+            )
+        elif mode == 'apply':
+            name = event.get('plan')
+            if not name:
+                raise ValueError("Mode 'apply' needs the name of the reviewed plan, e.g. {\"mode\": \"apply\", \"plan\": \"<name>\"}")
+            resume = apply_plan(plan_store.load(name), deadline, start = event.get('start', 0))
+            if resume is not None:
+                logger.info("Invoke again with {\"mode\": \"apply\", \"plan\": \"%s\", \"start\": %d} to finish the plan.", name, resume)
+        else:
+            # Check for attachments on the local policies, listed page by page, and delete policies without any
+            check_and_delete_policies(policies, deadline)
     except Exception as e:
         logger.error(f'An error occurred: {e}')
         handle_exception(e)
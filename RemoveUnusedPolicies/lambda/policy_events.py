@@ -0,0 +1,29 @@
+from collections import namedtuple
+
+PolicyChange = namedtuple('PolicyChange', ['event_name', 'policy_arn'])
+
+# CloudTrail event name -> request parameter holding the policy ARN. Only a detach can leave a policy
+# unused, everything else (new policies, removed permissions boundaries) is left to the daily scan
+TRACKED_EVENTS = {
+    'DetachRolePolicy': 'policyArn',
+    'DetachUserPolicy': 'policyArn',
+    'DetachGroupPolicy': 'policyArn'
+}
+
+def parse_policy_change(event):
+    """
+    Extracts the affected policy from a CloudTrail event delivered by EventBridge.
+
+    :param event: The EventBridge event.
+    :return: A PolicyChange, or None when the event is not a successful detach of a local policy.
+    """
+    detail = event.get('detail') or {}
+    event_name = detail.get('eventName')
+    if event_name not in TRACKED_EVENTS or detail.get('errorCode'):
+        return None
+
+    policy_arn = (detail.get('requestParameters') or {}).get(TRACKED_EVENTS[event_name])
+    # AWS managed policies can't be deleted, they are never tracked
+    if not policy_arn or policy_arn.startswith('arn:aws:iam::aws:policy/'):
+        return None
+    return PolicyChange(event_name, policy_arn)
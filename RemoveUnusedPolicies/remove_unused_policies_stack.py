@@ -3,6 +3,7 @@ from aws_cdk import (
     aws_events_targets as targets,
     aws_iam as iam,
     aws_lambda as lambda_,
+    aws_s3 as s3,
     Duration,
     Stack,
     Tags
@@ -37,6 +38,8 @@ class RemoveUnusedPoliciesStack(Stack):
                 "iam:ListPolicies",
                 "iam:ListPolicyVersions",
                 "iam:DeletePolicyVersion",
+                "iam:GenerateServiceLastAccessedDetails",
+                "iam:GetServiceLastAccessedDetails",
                 "sns:Publish"
             ]
         )
@@ -62,6 +65,10 @@ class RemoveUnusedPoliciesStack(Stack):
 
         #Define variables
         sns_topic = self.node.try_get_context("sns_topic")
+        # 'delete', 'plan' or 'apply', plan and apply keep the deletion plan in a bucket
+        mode = self.node.try_get_context("mode") or "delete"
+        # Handle each detach event on its own policy, with a daily full scan, instead of rescanning on CreatePolicy
+        per_policy_events = bool(self.node.try_get_context("per_policy_events"))
 
         # Create lambda function
         lambda_fn = lambda_.Function(
@@ -75,17 +82,40 @@ class RemoveUnusedPoliciesStack(Stack):
             role=lambda_role,
             environment= {
                         "sns_topic": (sns_topic),
-                        "AccountId": os.environ["CDK_DEFAULT_ACCOUNT"]
+                        "AccountId": os.environ["CDK_DEFAULT_ACCOUNT"],
+                        "mode": mode
                         },
         )
 
+        # Bucket for the deletion plans, one object per plan, written by {"mode": "plan"} and read by {"mode": "apply", "plan": <name>}
+        if mode != "delete":
+            plan_bucket = s3.Bucket(
+                self,
+                "PlanBucket",
+                block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
+                encryption=s3.BucketEncryption.S3_MANAGED,
+                enforce_ssl=True
+            )
+            plan_bucket.grant_read_write(lambda_fn)
+            lambda_fn.add_environment("plan_bucket", plan_bucket.bucket_name)
+
+        # Without per policy handling every event rescans all policies, so only CreatePolicy triggers the function
+        event_names = ["CreatePolicy"]
+        if per_policy_events:
+            lambda_fn.add_environment("per_policy_events", "true")
+            event_names = [
+                "DetachRolePolicy",
+                "DetachUserPolicy",
+                "DetachGroupPolicy"
+            ]
+
         # Create eventbridge rule pattern
         rule_pattern = events.EventPattern(
             source=["aws.iam"],
             detail_type=["AWS API Call via CloudTrail"],
             detail={
                 "eventSource": ["iam.amazonaws.com"],
-                "eventName": ["CreatePolicy"],
+                "eventName": event_names,
             }
         )
 
@@ -93,13 +123,28 @@ class RemoveUnusedPoliciesStack(Stack):
         iam_policy_rule = events.Rule(
             self,
             "iam_policy_rule",
-            description="Trigger when an IAM policy is created",
+            description="Trigger when an IAM policy is created or detached",
             event_pattern=rule_pattern,
         )
 
         # Attach taget to eventbridge rule
         iam_policy_rule.add_target(targets.LambdaFunction(lambda_fn))
 
+        # Events only cover the policies they name, a daily full scan catches what no event reported,
+        # e.g. new policies never attached or removed permissions boundaries
+        if per_policy_events:
+            scan_rule = events.Rule(
+                self,
+                "policy_scan_rule",
+                description="Daily scan of all local IAM policies",
+                schedule=events.Schedule.cron(minute="0", hour="3")
+            )
+            # Plan and apply deployments get a new nightly plan to review, under its own name
+            scan_rule.add_target(targets.LambdaFunction(
+                lambda_fn,
+                event=events.RuleTargetInput.from_object({"mode": "delete"} if mode == "delete" else {"mode": "plan", "label": "nightly"})
+            ))
+
         # Adding tag Name to resources, otherwise it will inherit stack Name tag
         Tags.of(lambda_fn).add("Name", "RemoveUnusedPoliciesFunction")
         Tags.of(lambda_role).add("Name", "LambdaRoleForRemoveUnusedPolicies")
@@ -0,0 +1,78 @@
+import os, sys
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lambda'))
+
+for name, value in (('AccountId', '000000000000'), ('AWS_LAMBDA_FUNCTION_NAME', 'test'), ('AWS_LAMBDA_LOG_GROUP_NAME', 'test'),
+                    ('sns_topic', 'test'), ('AWS_REGION', 'us-east-1'), ('AWS_DEFAULT_REGION', 'us-east-1')):
+    os.environ.setdefault(name, value)
+
+import pytest
+
+import lambda_handler
+from deletion_plan import FilePlanStore
+
+def plan(size):
+    return [{'arn': f"arn:aws:iam::000000000000:policy/p{index}", 'index': index} for index in range(size)]
+
+class FakeContext:
+    def get_remaining_time_in_millis(self):
+        return 60000
+
+@pytest.fixture
+def iam(monkeypatch):
+    """Current (attachments, boundaries) per policy ARN, every policy starts unused."""
+    counts = {entry['arn']: (0, 0) for entry in plan(10)}
+    deleted = []
+    monkeypatch.setattr(lambda_handler, 'get_policy_counts', counts.get)
+    monkeypatch.setattr(lambda_handler, 'delete_policy', lambda policy_arn: deleted.append(policy_arn) or True)
+    monkeypatch.setattr(lambda_handler, 'batch_size', 3)
+    return counts, deleted
+
+def test_iter_batches_starts_at_index(monkeypatch):
+    monkeypatch.setattr(lambda_handler, 'batch_size', 3)
+    batches = list(lambda_handler.iter_batches(plan(8), start = 2))
+    assert [[entry['index'] for entry in batch] for batch in batches] == [[2, 3, 4], [5, 6, 7]]
+
+def test_apply_entry_skips_policies_in_use(iam):
+    counts, deleted = iam
+    entry = plan(1)[0]
+    counts[entry['arn']] = (1, 0)
+    assert lambda_handler.apply_entry(entry) is None
+    assert deleted == []
+
+def test_apply_entry_counts_missing_policy_as_done(iam):
+    counts, deleted = iam
+    entry = plan(1)[0]
+    del counts[entry['arn']]
+    assert lambda_handler.apply_entry(entry) is True
+    assert deleted == []
+
+def test_apply_plan_resumes_from_start(iam):
+    _, deleted = iam
+    # A passed deadline stops before the first batch and reports where to resume
+    assert lambda_handler.apply_plan(plan(10), time() - 1, start = 4) == 4
+    assert deleted == []
+    assert lambda_handler.apply_plan(plan(10), time() + 60, start = 4) is None
+    assert deleted == [entry['arn'] for entry in plan(10)[4:]]
+
+def test_cloudtrail_event_does_nothing_in_plan_mode(monkeypatch, iam):
+    _, deleted = iam
+    monkeypatch.setattr(lambda_handler, 'default_mode', 'plan')
+    monkeypatch.setattr(lambda_handler, 'per_policy_events', False)
+    monkeypatch.setattr(lambda_handler, 'list_policies', lambda scope = 'All': pytest.fail('listed policies'))
+    monkeypatch.setattr(lambda_handler, 'handle_exception', lambda e: pytest.fail(str(e)))
+    lambda_handler.lambda_handler({'detail-type': 'AWS API Call via CloudTrail', 'detail': {'eventName': 'CreatePolicy'}}, FakeContext())
+    lambda_handler.lambda_handler({'detail-type': 'Scheduled Event'}, FakeContext())
+    assert deleted == []
+
+def test_apply_runs_the_named_plan(monkeypatch, tmp_path, iam):
+    _, deleted = iam
+    store = FilePlanStore(str(tmp_path))
+    store.save('reviewed.jsonl', plan(2))
+    store.save('newer.jsonl', plan(5))
+    monkeypatch.setattr(lambda_handler, 'default_mode', 'apply')
+    monkeypatch.setattr(lambda_handler, 'create_plan_store', lambda: store)
+    monkeypatch.setattr(lambda_handler, 'handle_exception', lambda e: pytest.fail(str(e)))
+    lambda_handler.lambda_handler({'mode': 'apply', 'plan': 'reviewed.jsonl'}, FakeContext())
+    assert deleted == [entry['arn'] for entry in plan(2)]
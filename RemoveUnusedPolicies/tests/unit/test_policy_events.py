@@ -0,0 +1,37 @@
+import os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lambda'))
+
+for name, value in (('AccountId', '000000000000'), ('AWS_LAMBDA_FUNCTION_NAME', 'test'), ('AWS_LAMBDA_LOG_GROUP_NAME', 'test'),
+                    ('sns_topic', 'test'), ('AWS_REGION', 'us-east-1'), ('AWS_DEFAULT_REGION', 'us-east-1')):
+    os.environ.setdefault(name, value)
+
+import lambda_handler
+from policy_events import PolicyChange, parse_policy_change
+
+POLICY = 'arn:aws:iam::000000000000:policy/p'
+
+def event(event_name, policy_arn = POLICY, error = None):
+    detail = {'eventName': event_name, 'requestParameters': {'policyArn': policy_arn}}
+    if error:
+        detail['errorCode'] = error
+    return {'detail-type': 'AWS API Call via CloudTrail', 'detail': detail}
+
+def test_only_successful_detaches_of_local_policies_are_parsed():
+    assert parse_policy_change(event('DetachRolePolicy')) == PolicyChange('DetachRolePolicy', POLICY)
+    assert parse_policy_change(event('AttachRolePolicy')) is None
+    assert parse_policy_change(event('DetachRolePolicy', error = 'AccessDenied')) is None
+    assert parse_policy_change(event('DetachUserPolicy', 'arn:aws:iam::aws:policy/ReadOnlyAccess')) is None
+
+def test_duplicated_detach_follows_iam(monkeypatch):
+    counts, deleted = {POLICY: (1, 0)}, []
+    monkeypatch.setattr(lambda_handler, 'default_mode', 'delete')
+    monkeypatch.setattr(lambda_handler, 'get_policy_counts', counts.get)
+    monkeypatch.setattr(lambda_handler, 'delete_policy', lambda policy_arn: deleted.append(policy_arn) or True)
+
+    # A redelivered detach while another attachment remains deletes nothing
+    lambda_handler.handle_policy_change(PolicyChange('DetachRolePolicy', POLICY))
+    assert deleted == []
+    counts[POLICY] = (0, 0)
+    lambda_handler.handle_policy_change(PolicyChange('DetachRolePolicy', POLICY))
+    assert deleted == [POLICY]
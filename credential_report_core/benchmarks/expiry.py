@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Times expiry computation over synthetic credential reports: read_report plus days_until on whole
+columns, with and without numpy, against the per user days_till_expire loop.
+    python benchmarks/expiry.py --users 1000 10000 50000
+"""
+import argparse, datetime, os, random, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python'))
+
+import credential_report
+
+HEADER = ("user,arn,user_creation_time,password_enabled,password_last_used,password_last_changed,"
+          "password_next_rotation,mfa_active,access_key_1_active,access_key_1_last_rotated,"
+          "access_key_1_last_used_date,access_key_1_last_used_region,access_key_1_last_used_service,"
+          "access_key_2_active,access_key_2_last_rotated,access_key_2_last_used_date,"
+          "access_key_2_last_used_region,access_key_2_last_used_service,cert_1_active,"
+          "cert_1_last_rotated,cert_2_active,cert_2_last_rotated\n")
+
+def synthetic_report(users, seed = 1):
+    rng = random.Random(seed)
+    today = datetime.date.today()
+
+    def flag(probability):
+        return 'true' if rng.random() < probability else 'false'
+
+    def date():
+        if rng.random() < 0.2:
+            return 'N/A'
+        return (today - datetime.timedelta(rng.randrange(400))).isoformat() + 'T09:00:00+00:00'
+
+    rows = [HEADER]
+    for index in range(users):
+        rows.append(f"user{index},arn:aws:iam::123456789012:user/user{index},{date()},{flag(0.7)},{date()},{date()},N/A,"
+                    f"{flag(0.5)},{flag(0.6)},{date()},{date()},us-east-1,s3,{flag(0.2)},{date()},{date()},N/A,N/A,"
+                    f"false,N/A,false,N/A\n")
+    return ''.join(rows).encode('utf-8')
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+def per_user(content, max_age):
+    # The previous approach, DictReader rows and one days_till_expire call per user and date
+    rows = credential_report.csv.DictReader(content.decode('utf-8').splitlines())
+    return [[credential_report.days_till_expire(row[column], max_age) if row[column] != 'N/A' else None
+             for column in credential_report.EXPIRY_COLUMNS]
+            for row in rows]
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type = int, nargs = '+', default = [1000, 10000, 50000])
+    args = parser.parse_args()
+    numpy = credential_report.np
+
+    print(f"{'users':>8} {'read_report':>12} {'days_until':>11} {'numpy':>9} {'iter rows':>10} {'per user':>9} {'audit':>7}  (ms)")
+    for users in args.users:
+        content = synthetic_report(users)
+        _, _, days = credential_report.read_report(content)
+        _, read_ms = timed(credential_report.read_report, content)
+        columns = list(days.values())
+
+        credential_report.np = None
+        plain, plain_ms = timed(lambda: [credential_report.days_until(column, 90) for column in columns])
+        credential_report.np = numpy
+        vectorized, numpy_ms = timed(lambda: [credential_report.days_until(column, 90) for column in columns])
+        if numpy is not None:
+            assert plain == vectorized
+
+        _, rows_ms = timed(lambda: list(credential_report.iter_credential_report(content, 90)))
+        _, per_user_ms = timed(per_user, content, 90)
+        report = credential_report.read_report(content)
+        _, audit_ms = timed(lambda: credential_report.CredentialAudit().evaluate(report))
+        numpy_column = f"{numpy_ms:9.1f}" if numpy is not None else f"{'n/a':>9}"
+        print(f"{users:8d} {read_ms:12.1f} {plain_ms:11.1f} {numpy_column} {rows_ms:10.1f} {per_user_ms:9.1f} {audit_ms:7.1f}")
+
+if __name__ == '__main__':
+    main()
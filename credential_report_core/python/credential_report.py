@@ -0,0 +1,246 @@
+from array import array
+from collections import namedtuple
+from time import sleep, time
+import csv, io
+import datetime
+import logging
+
+try:
+    import numpy as np
+except ImportError:
+    # numpy is optional, the pure Python path gives the same results
+    np = None
+
+logger = logging.getLogger()
+
+EPOCH = datetime.date(1970, 1, 1)
+# Epoch day for dates the report has no value for, e.g. N/A or no_information
+MISSING = -2 ** 31
+# Dates that age into an expiry
+EXPIRY_COLUMNS = ('password_last_changed', 'access_key_1_last_rotated', 'access_key_2_last_rotated')
+# Everything the expiry and the audit rules read, kept per column as epoch days or flags
+DATE_COLUMNS = EXPIRY_COLUMNS + ('user_creation_time', 'password_last_used', 'access_key_1_last_used_date', 'access_key_2_last_used_date')
+FLAG_COLUMNS = ('password_enabled', 'mfa_active', 'access_key_1_active', 'access_key_2_active')
+# Audit thresholds in days, overridden per rule by the credential_rules JSON, false or null skips a rule
+DEFAULT_RULES = {'access_key_rotation': 90, 'access_key_unused': 90, 'password_unused': 90, 'mfa_missing': True}
+
+ReportColumns = namedtuple('ReportColumns', ['users', 'flags', 'days'])
+
+class CredentialReportRow:
+    __slots__ = ('user', 'password_enabled', 'password_expires')
+
+    def __init__(self, user, password_enabled, password_expires):
+        self.user = user
+        self.password_enabled = password_enabled
+        self.password_expires = password_expires
+
+def to_epoch_day(value):
+    # The report uses ISO 8601 timestamps, e.g. 2023-01-31T09:00:00+00:00, only the date matters
+    try:
+        return (datetime.date.fromisoformat(value[:10]) - EPOCH).days
+    except ValueError:
+        return MISSING
+
+def days_till_expire(last_changed, max_age, today = None):
+    if type(last_changed) is str:
+        last_changed_date=datetime.date.fromisoformat(last_changed[:10])
+    elif type(last_changed) is datetime.datetime:
+        last_changed_date=last_changed.date()
+    else:
+        return -99999
+    expires = (last_changed_date + datetime.timedelta(max_age)) - (today or datetime.date.today())
+    return(expires.days)
+
+def read_report(content, columns = DATE_COLUMNS, flag_columns = FLAG_COLUMNS):
+    # One pass over the CSV into ReportColumns, the flags as array('b') and the dates as epoch days per column
+    report = ReportColumns([], {column: array('b') for column in flag_columns}, {column: array('i') for column in columns})
+    reader = csv.reader(io.TextIOWrapper(io.BytesIO(content), encoding = 'utf-8', newline = ''))
+    header = next(reader, None)
+    if header is None:
+        return report
+    user_index = header.index('user')
+    flags = [(report.flags[column].append, header.index(column)) for column in flag_columns]
+    dates = [(report.days[column].append, header.index(column)) for column in columns]
+    for row in reader:
+        report.users.append(row[user_index])
+        for append, index in flags:
+            append(row[index] == 'true')
+        for append, index in dates:
+            append(to_epoch_day(row[index]))
+    return report
+
+def days_until(epoch_days, max_age, today = None):
+    # Days left until every date is max_age days old for the whole column at once, MISSING stays MISSING
+    offset = max_age - ((today or datetime.date.today()) - EPOCH).days
+    if np is not None:
+        values = np.frombuffer(epoch_days, dtype = np.int32)
+        return np.where(values == MISSING, MISSING, values + offset).tolist()
+    return [MISSING if day == MISSING else day + offset for day in epoch_days]
+
+def days_since(epoch_days, today = None):
+    return [MISSING if days == MISSING else -days for days in days_until(epoch_days, 0, today)]
+
+def iter_credential_report(content, max_age):
+    # content is the raw CSV or a ReportColumns from read_report. Users without a password, or accounts
+    # without a maximum password age, get password_expires None. Key age is covered by CredentialAudit
+    report = content if isinstance(content, ReportColumns) else read_report(content, ('password_last_changed',), ('password_enabled',))
+    expires = days_until(report.days['password_last_changed'], max_age) if max_age else None
+
+    enabled = report.flags['password_enabled']
+    for position, user in enumerate(report.users):
+        password_enabled = bool(enabled[position])
+        password_expires = None
+        if password_enabled and expires is not None and expires[position] != MISSING:
+            password_expires = expires[position]
+        yield CredentialReportRow(user, password_enabled, password_expires)
+
+class CredentialAudit:
+    # Evaluates the rule set over ReportColumns, every rule works on whole columns without further IAM calls
+    TITLES = {
+        'access_key_rotation': "Access keys not rotated in {} days",
+        'access_key_unused': "Active access keys unused for {} days",
+        'password_unused': "Console passwords unused for {} days",
+        'mfa_missing': "Console access without MFA"
+    }
+
+    def __init__(self, rules = None, max_size = 4000):
+        self.rules = {rule: threshold for rule, threshold in dict(DEFAULT_RULES, **(rules or {})).items() if threshold}
+        self.max_size = max_size
+        self.findings = {rule: [] for rule in self.TITLES}
+
+    def evaluate(self, report, today = None, prefix = ""):
+        today = today or datetime.date.today()
+        flags, days = report.flags, report.days
+        # Never used credentials age from the moment they were created
+        created = days_since(days['user_creation_time'], today)
+
+        def age_or_created(column, fallback):
+            return [fallback[position] if age == MISSING else age for position, age in enumerate(days_since(days[column], today))]
+
+        for key in ('1', '2'):
+            active = flags['access_key_{}_active'.format(key)]
+            rotated = days_since(days['access_key_{}_last_rotated'.format(key)], today)
+            if 'access_key_rotation' in self.rules:
+                for position, age in enumerate(rotated):
+                    if active[position] and age != MISSING and age > self.rules['access_key_rotation']:
+                        self.findings['access_key_rotation'].append((age, "{}{} key {} rotated {} days ago".format(prefix, report.users[position], key, age)))
+            if 'access_key_unused' in self.rules:
+                for position, age in enumerate(age_or_created('access_key_{}_last_used_date'.format(key), rotated)):
+                    if active[position] and age != MISSING and age > self.rules['access_key_unused']:
+                        self.findings['access_key_unused'].append((age, "{}{} key {} unused for {} days".format(prefix, report.users[position], key, age)))
+
+        enabled = flags['password_enabled']
+        if 'password_unused' in self.rules:
+            for position, age in enumerate(age_or_created('password_last_used', created)):
+                if enabled[position] and age != MISSING and age > self.rules['password_unused']:
+                    self.findings['password_unused'].append((age, "{}{} unused for {} days".format(prefix, report.users[position], age)))
+        if 'mfa_missing' in self.rules:
+            mfa = flags['mfa_active']
+            for position, user in enumerate(report.users):
+                if enabled[position] and not mfa[position]:
+                    self.findings['mfa_missing'].append((0, prefix + user))
+        return self
+
+    def lines(self):
+        for rule, title in self.TITLES.items():
+            findings = sorted(self.findings[rule], key = lambda finding: -finding[0])
+            if not findings:
+                continue
+            title = "{} ({}):".format(title.format(self.rules.get(rule)), len(findings))
+            for _, line in findings:
+                yield title, line
+
+    def messages(self, header = ""):
+        return pack_messages(self.lines(), header, self.max_size)
+
+class ExpiryDigest:
+    # Groups password expiry per user into buckets and renders them as a few size-bounded messages
+    TITLES = {
+        'expiring': "Passwords expiring",
+        'expired': "ATTENTION! Passwords expired",
+        'long_expired': "ATTENTION! Passwords expired more than {} days ago"
+    }
+
+    def __init__(self, long_expired_days = 90, max_size = 4000):
+        self.long_expired_days = long_expired_days
+        self.max_size = max_size
+        self.buckets = {bucket: [] for bucket in self.TITLES}
+
+    def add(self, user, password_expires):
+        if password_expires > 0:
+            self.buckets['expiring'].append((password_expires, user))
+        elif password_expires >= -self.long_expired_days:
+            self.buckets['expired'].append((-password_expires, user))
+        else:
+            self.buckets['long_expired'].append((-password_expires, user))
+
+    def lines(self, buckets = None):
+        # buckets limits the output to some of the sections, e.g. ('expiring',)
+        for bucket, title in self.TITLES.items():
+            if buckets is not None and bucket not in buckets:
+                continue
+            entries = sorted(self.buckets[bucket])
+            if not entries:
+                continue
+            title = "{} ({}):".format(title.format(self.long_expired_days), len(entries))
+            for days, user in entries:
+                if bucket == 'expiring':
+                    yield title, "{} in {} days".format(user, days)
+                else:
+                    yield title, "{} {} days ago".format(user, days)
+
+    def messages(self, header = ""):
+        return pack_messages(self.lines(), header, self.max_size)
+
+def pack_messages(lines, header = "", max_size = 4000):
+    # Packs (title, line) pairs into messages of at most max_size characters, a section split
+    # across messages repeats its title, so every message reads on its own
+    message, size, current_title = [], 0, None
+    for title, line in lines:
+        if message and size + len(line) + 1 > max_size:
+            yield "\n".join(message)
+            message, size, current_title = [], 0, None
+        if not message and header:
+            message.append(header)
+            size += len(header) + 1
+        if title != current_title:
+            message.append(title)
+            size += len(title) + 1
+            current_title = title
+        message.append(line)
+        size += len(line) + 1
+    if message:
+        yield "\n".join(message)
+
+def get_credential_report(iam_client, deadline = None, reuse_age = 3600):
+    # A report younger than reuse_age seconds is reused, generating a new one takes several seconds
+    try:
+        response = iam_client.get_credential_report()
+        age = datetime.datetime.now(datetime.timezone.utc) - response['GeneratedTime']
+        if age.total_seconds() <= reuse_age:
+            logger.info("Reusing credential report generated {} seconds ago".format(int(age.total_seconds())))
+            return(response['Content'])
+    except (iam_client.exceptions.CredentialReportNotPresentException,
+            iam_client.exceptions.CredentialReportExpiredException,
+            iam_client.exceptions.CredentialReportNotReadyException):
+        pass
+
+    deadline = deadline or time() + 30
+    delay = 0.5
+    while iam_client.generate_credential_report()['State'] != 'COMPLETE':
+        remaining = deadline - time()
+        if remaining <= 0:
+            raise TimeoutError("Credential report was not ready before the deadline")
+        sleep(min(delay, remaining))
+        delay = min(delay * 2, 8)
+    response = iam_client.get_credential_report()
+    return(response['Content'])
+
+def get_max_password_age(iam_client):
+    try: 
+        response = iam_client.get_account_password_policy()
+        return response['PasswordPolicy']['MaxPasswordAge']
+    except iam_client.exceptions.NoSuchEntityException:
+        # No password policy, so passwords never expire. Anything else, e.g. AccessDenied, is raised,
+        # returning None would silently switch off expiry reporting
+        return None
@@ -0,0 +1,55 @@
+import datetime, os, sys
+from array import array
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'python'))
+
+import pytest
+
+import credential_report
+from credential_report import EPOCH, MISSING, ExpiryDigest, days_until, iter_credential_report, pack_messages, to_epoch_day
+
+TODAY = datetime.date(2024, 3, 1)
+
+@pytest.mark.parametrize('value', ['N/A', 'no_information', 'not_supported', ''])
+def test_to_epoch_day_without_a_date_is_missing(value):
+    assert to_epoch_day(value) == MISSING
+
+def test_to_epoch_day_keeps_the_date_only():
+    assert to_epoch_day('2024-03-01T23:59:59+00:00') == (TODAY - EPOCH).days
+
+@pytest.mark.parametrize('numpy', [True, False])
+def test_days_until_with_and_without_numpy(monkeypatch, numpy):
+    if numpy:
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(credential_report, 'np', None)
+    today = (TODAY - EPOCH).days
+    epoch_days = array('i', [today, today - 90, today - 100, MISSING])
+    assert days_until(epoch_days, 90, TODAY) == [90, 0, -10, MISSING]
+
+def test_iter_credential_report_skips_users_without_password():
+    changed = (TODAY - datetime.timedelta(30)).isoformat() + 'T09:00:00+00:00'
+    content = ("user,password_enabled,password_last_changed\n"
+               "alice,true,{}\nbob,false,{}\ncarol,true,N/A\n").format(changed, changed).encode('utf-8')
+    age = (datetime.date.today() - TODAY).days
+    rows = {row.user: row.password_expires for row in iter_credential_report(content, 90)}
+    assert rows == {'alice': 60 - age, 'bob': None, 'carol': None}
+
+@pytest.mark.parametrize('password_expires, bucket', [
+    (1, 'expiring'),
+    (0, 'expired'),
+    (-90, 'expired'),
+    (-91, 'long_expired')
+])
+def test_expiry_digest_bucket_edges(password_expires, bucket):
+    digest = ExpiryDigest(long_expired_days = 90)
+    digest.add('alice', password_expires)
+    assert [name for name, entries in digest.buckets.items() if entries] == [bucket]
+
+def test_pack_messages_splits_and_repeats_the_title():
+    lines = [('Title:', 'user{:02d}'.format(index)) for index in range(10)]
+    messages = list(pack_messages(lines, "Header", max_size = 40))
+    assert len(messages) > 1
+    assert all(len(message) <= 40 for message in messages)
+    assert all(message.split("\n")[:2] == ["Header", "Title:"] for message in messages)
+    assert [line for message in messages for line in message.split("\n")[2:]] == [line for _, line in lines]
@@ -0,0 +1,32 @@
+import os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'python'))
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+from botocore.stub import Stubber
+
+from credential_report import get_max_password_age
+
+@pytest.fixture
+def iam():
+    client = boto3.client('iam', region_name = 'us-east-1', aws_access_key_id = 'test', aws_secret_access_key = 'test')
+    with Stubber(client) as stubber:
+        yield client, stubber
+
+def test_max_password_age(iam):
+    client, stubber = iam
+    stubber.add_response('get_account_password_policy', {'PasswordPolicy': {'MaxPasswordAge': 90}})
+    assert get_max_password_age(client) == 90
+
+def test_no_password_policy_means_no_expiry(iam):
+    client, stubber = iam
+    stubber.add_client_error('get_account_password_policy', 'NoSuchEntity', http_status_code = 404)
+    assert get_max_password_age(client) is None
+
+def test_access_denied_is_raised(iam):
+    client, stubber = iam
+    stubber.add_client_error('get_account_password_policy', 'AccessDenied', http_status_code = 403)
+    with pytest.raises(ClientError):
+        get_max_password_age(client)